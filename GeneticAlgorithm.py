@@ -1,17 +1,170 @@
+import csv
+import os
 import random
-import functools
-from collections import defaultdict
-from evaluate import evaluate
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pieces
+import selection
+import setup_generator
+import symmetry
+import utils
+from evaluate import evaluate, evaluate_batch
+
+# Columns of the per-generation telemetry, see genetic_algoritgm.record_generation
+STATS_FIELDS = ["generation", "best", "mean", "diversity", "best_so_far", "seconds"]
+
+
+def layout_key(board):
+    """Hashable key identifying a layout (a list of piece names or an array of piece types)"""
+    if isinstance(board, np.ndarray):
+        return board.tobytes()
+    return tuple(piece for row in board for piece in row)
+
+
+def canonical_layout_key(board):
+    """Same as layout_key, shared by a layout and its mirror image"""
+    if isinstance(board, np.ndarray):
+        return symmetry.canonical_layout_bytes(board)
+    return symmetry.canonical_layout_key(board)
+
+
+def encode_population(population):
+    """Returns a list of layouts as a (P, 4, 10) int8 array of piece types (see pieces.py)"""
+    rank_of = pieces.RANK_OF
+    return np.array([[[rank_of[p] for p in row] for row in board] for board in population],
+                    dtype=np.int8).reshape(-1, 4, 10)
+
+
+def decode_population(array):
+    """Returns the layouts of a (P, 4, 10) array of piece types as lists of piece names"""
+    names = pieces.RANK_NAMES
+    return [[[names[t] for t in row] for row in board] for board in array.tolist()]
+
+
+def score_chunk(fitness, chunk, batch):
+    """Process pool task: scores a (n, 4, 10) array of piece types with fitness, which takes
+    the whole array if batch is set and a layout of piece names otherwise"""
+    if batch:
+        return np.asarray(fitness(chunk)).tolist()
+    return [fitness(layout) for layout in decode_population(chunk)]
+
+
+class PoolScorer:
+
+    def __init__(self, fitness, workers, chunk_size=None, batch=False):
+        """Scores layouts across a process pool. Layouts are shipped to the workers as
+        int8 arrays of piece types, chunk_size layouts per task, and scores come back in order."""
+        self.fitness = fitness
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.batch = batch
+        self.executor = ProcessPoolExecutor(workers)
+
+    def __call__(self, array):
+        """Returns the scores of a (n, 4, 10) array of piece types, in order"""
+        chunk_size = self.chunk_size or max(1, -(-len(array) // (self.workers * 4)))
+        futures = [self.executor.submit(score_chunk, self.fitness, array[i:i + chunk_size], self.batch)
+                   for i in range(0, len(array), chunk_size)]
+        return [score for future in futures for score in future.result()]
+
+    def close(self):
+        self.executor.shutdown()
+
+
+class FitnessCache:
+
+    def __init__(self, fitness, max_size=100000, batch_fitness=None, mirror=False):
+        """Bounded cache of fitness scores keyed by layout, least recently used entries are
+        evicted first once max_size layouts are stored. If batch_fitness is given, score_all
+        scores all the layouts missing from the cache with a single batch_fitness(layouts) call.
+        With mirror a layout and its mirror image share one entry, only use it with a mirror
+        symmetric fitness (evaluate is not, see symmetry.py)."""
+        self.fitness = fitness
+        self.batch_fitness = batch_fitness
+        self.key = canonical_layout_key if mirror else layout_key
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, board):
+        if self.batch_fitness is not None:
+            return self.score_all([board])[0]
+        key = self.key(board)
+        score = self.entries.get(key)
+        if score is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return score
+        self.misses += 1
+        score = self.fitness(board)
+        self.store(key, score)
+        return score
+
+    def store(self, key, score):
+        self.entries[key] = score
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def score_all(self, boards):
+        """Returns the scores of boards, in order"""
+        if self.batch_fitness is None:
+            return [self(board) for board in boards]
+
+        keys = [self.key(board) for board in boards]
+        scores = {}
+        missing = {}
+        for key, board in zip(keys, boards):
+            if key in scores or key in missing:
+                continue
+            score = self.entries.get(key)
+            if score is None:
+                missing[key] = board
+            else:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                scores[key] = score
+        if missing:
+            self.misses += len(missing)
+            for key, score in zip(missing, self.batch_fitness(list(missing.values()))):
+                scores[key] = score
+                self.store(key, score)
+        return [scores[key] for key in keys]
+
+    def __len__(self):
+        return len(self.entries)
 
 
 class genetic_algoritgm:
     
-    def __init__(self, populationSize, generation, mutationRate, crossoverRate):
+    def __init__(self, populationSize, generation, mutationRate, crossoverRate, cacheSize=100000, vectorised=False,
+                 workers=None, chunkSize=None, fitness=None, selection="roulette", tournamentSize=3,
+                 mirrorCache=False):
         self.populationSize = populationSize
         self.generation = generation
         self.mutationRate = mutationRate
         self.crossoverRate = crossoverRate
         self.population = []
+        # In vectorised mode the population is a (P, 4, 10) int8 array of piece types
+        # (see pieces.py) and the new layouts of a generation are scored with one batch call
+        self.vectorised = vectorised
+        # fitness scores a layout of piece names, or in vectorised mode a whole (n, 4, 10) array.
+        # With workers it must be a module level function so it can be sent to the process pool.
+        self.fitness = fitness or (evaluate_batch if vectorised else evaluate)
+        self.workers = workers
+        self.chunkSize = chunkSize
+        self.pool = None
+        # "roulette", "sus" (stochastic universal sampling) or "tournament"
+        self.selection = selection
+        self.tournamentSize = tournamentSize
+        # Best layout seen so far, its score and one row of telemetry per generation
+        self.best_board = None
+        self.best_score = None
+        self.stats = []
+        # mirrorCache shares cached scores between mirror images, for mirror symmetric fitness functions
+        self.fitness_cache = FitnessCache(self.fitness, cacheSize, batch_fitness=self.score_batch, mirror=mirrorCache)
         self.names_of_pieces = ["spy", "one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "bomb", "flag"]
         self.starting_quantities = {"bomb"  : 6,
                                 "one"   : 1,
@@ -25,39 +178,64 @@ class genetic_algoritgm:
                                 "nine"  : 8,
                                 "spy"   : 1,
                                 "flag"  : 1}
+        self.type_quantities = {pieces.RANK_OF[k]: v for k, v in self.starting_quantities.items()}
 
 
     def random_board_layout(self):
-        board = []
-        board_columns = 10
-        row = []
-        n = 0
-        pieces_used = defaultdict(lambda: 0)
-        while n < 40:
-            piece = random.choice(self.names_of_pieces)
-            if pieces_used[piece] < self.starting_quantities[piece]:
-                row.append(f"{piece}")
-                pieces_used[piece] += 1
-                n += 1
-                if len(row) == board_columns:
-                    board.append(row)
-                    row = []
-        return board
-    
-    def createPopulation(self):
-        for i in range(self.populationSize):
-            randomBoard = self.random_board_layout()
-            self.population.append(randomBoard)
-        self.population = sorted(self.population, key= functools.cmp_to_key(compare))
+        return setup_generator.random_layout()
 
+    def random_population_array(self, n):
+        """Returns n random layouts as a (n, 4, 10) array of piece types"""
+        return setup_generator.random_layouts(n, random.getrandbits(64))
+
+    def createPopulation(self):
+        if self.vectorised:
+            self.population = self.random_population_array(self.populationSize)
+        else:
+            for i in range(self.populationSize):
+                randomBoard = self.random_board_layout()
+                self.population.append(randomBoard)
+        self.sort_population()
+
+
+    def population_scores(self):
+        """Returns the fitness of every member of the population, in order"""
+        return self.fitness_cache.score_all(self.population)
+
+    def score_batch(self, boards):
+        """Scores layouts that are not in the fitness cache yet, across the process pool
+        when execute runs with workers"""
+        if self.pool is not None:
+            array = np.stack(boards) if self.vectorised else encode_population(boards)
+            return self.pool(array)
+        if self.vectorised:
+            return np.asarray(self.fitness(np.stack(boards))).tolist()
+        return [self.fitness(board) for board in boards]
+
+    def take(self, indices):
+        """Returns the members of the population at indices as a new population"""
+        if self.vectorised:
+            return self.population[np.array(indices, dtype=np.intp)]
+        return [self.population[i] for i in indices]
+
+    def layouts(self):
+        """Returns the population as layouts of piece names"""
+        if self.vectorised:
+            return decode_population(self.population)
+        return self.population
+
+    def sort_population(self):
+        """Sort the population by ascending fitness"""
+        scores = self.population_scores()
+        self.population = self.take(sorted(range(len(scores)), key=scores.__getitem__))
 
     def evaluate(self, board):
-        """evalutes the board and returns a fitness score)"""
-        return evaluate(board)
+        """evalutes the board and returns a fitness score, each distinct layout is scored once"""
+        return self.fitness_cache.score_all([board])[0]
 
     def calculate_fitness_probabilities(self):
         fitnessScore = []
-        totalFitness = ((self.populationSize + 1) * self.populationSize) / 2
+        totalFitness = ((len(self.population) + 1) * len(self.population)) / 2
         probabilities = []
         for idx,board in enumerate(self.population):
             probabilities.append((idx+1)/totalFitness)
@@ -65,26 +243,34 @@ class genetic_algoritgm:
 
 
     def rouletteSelection(self, probabilities):
-        randomNumbers = []
-        for i in range(len(self.population)):
-            randomNumbers.append(random.random())
-       
-        cumulativeProbabilities = [sum(probabilities[:x+1]) for x in range(len(probabilities))]
-        newPopulation = []
-        for r in randomNumbers:
-            for x in range(len(cumulativeProbabilities)):
-                if(x == 0):
-                    if r > 0 and r <= cumulativeProbabilities[x]:
-                        newPopulation.append(self.population[x])
-                else:
-                    if r > cumulativeProbabilities[x-1] and r <cumulativeProbabilities[x]:
-                        newPopulation.append(self.population[x])
-        return newPopulation
+        return self.take(selection.roulette(probabilities, self.populationSize))
+
+    def susSelection(self, probabilities):
+        return self.take(selection.stochastic_universal(probabilities, self.populationSize))
+
+    def tournamentSelection(self):
+        scores = self.population_scores()
+        return self.take(selection.tournament(scores, self.populationSize, self.tournamentSize))
+
+    def select(self):
+        """Returns the next generation's parents, always populationSize of them"""
+        if self.selection == "tournament":
+            return self.tournamentSelection()
+        probabilities = self.calculate_fitness_probabilities()
+        if self.selection == "sus":
+            return self.susSelection(probabilities)
+        return self.rouletteSelection(probabilities)
 
     def create_offspring(self, parent1, parent2):
         """This method takes two parents and creates an offspring using crossover and mutation"""
-        child = [[" "] * 10 for _ in range(4)]
-        current_board = current_board = { k: 0 for k in self.starting_quantities.keys() }
+        if self.vectorised:
+            child = self.create_layout_offspring(parent1.tolist(), parent2.tolist(), self.type_quantities)
+            return np.array(child, dtype=np.int8)
+        return self.create_layout_offspring(parent1, parent2, self.starting_quantities)
+
+    def create_layout_offspring(self, parent1, parent2, starting_quantities):
+        child = [[None] * 10 for _ in range(4)]
+        current_board = { k: 0 for k in starting_quantities.keys() }
         crossover_point = random.randint(0, 9)
         parent1, parent2 = random_swap_list(parent1, parent2)
         for i in range(4):
@@ -94,14 +280,14 @@ class genetic_algoritgm:
 
         for i in range(4):
             for j in range(crossover_point+1, 9):
-                if (current_board[parent2[i][j]] < self.starting_quantities[parent2[i][j]]):
+                if (current_board[parent2[i][j]] < starting_quantities[parent2[i][j]]):
                     child[i][j] = parent2[i][j]
                     current_board[parent2[i][j]] += 1
 
         remaining_pieces = []
-        for key in self.starting_quantities:
-            if (current_board[key] < self.starting_quantities[key]):
-                for _ in range(self.starting_quantities[key] - current_board[key]):
+        for key in starting_quantities:
+            if (current_board[key] < starting_quantities[key]):
+                for _ in range(starting_quantities[key] - current_board[key]):
                     remaining_pieces.append(key)
         
         random.shuffle(remaining_pieces)
@@ -109,7 +295,7 @@ class genetic_algoritgm:
         k = 0
         for i in range(4):
             for j in range(10):
-                if child[i][j] == " ":
+                if child[i][j] is None:
                     child[i][j] = remaining_pieces[k]
                     k+=1
 
@@ -121,6 +307,9 @@ class genetic_algoritgm:
             r = random.random()
             if r < self.crossoverRate:
                 crossoverParents.append(self.population[i])
+        if self.vectorised:
+            # Rows of the population array are views, keep the parents intact while children replace them
+            crossoverParents = [parent.copy() for parent in crossoverParents]
         
         for x in range(len(crossoverParents)):
             parent1 = crossoverParents[x]
@@ -133,19 +322,174 @@ class genetic_algoritgm:
             self.population[x] = child
 
     
-    def execute(self):
-        self.createPopulation()
-        for _ in range(self.generation):
-            probabilities = self.calculate_fitness_probabilities()
-            self.population = self.rouletteSelection(probabilities)
-            self.population = sorted(self.population, key= functools.cmp_to_key(compare))
-            self.crossover()
+    def execute(self, timeBudget=None, stallGenerations=None, checkpointPath=None, checkpointInterval=100):
+        """Evolve the population for up to self.generation generations and return the best
+        (layout, score) found. Stops early once timeBudget seconds have passed or the best score
+        has not improved for stallGenerations generations. With checkpointPath the run is saved
+        every checkpointInterval generations and when it stops, see resume."""
+        if self.workers:
+            self.pool = PoolScorer(self.fitness, self.workers, self.chunkSize, batch=self.vectorised)
+        start = time.perf_counter()
+        try:
+            self.createPopulation()
+            self.record_generation(0, start)
+            self.run_generations(1, 0, start, timeBudget, stallGenerations, checkpointPath, checkpointInterval)
+        finally:
+            if self.pool is not None:
+                self.pool.close()
+                self.pool = None
+        return self.best_so_far()
+
+    def resume(self, path, timeBudget=None, stallGenerations=None, checkpointPath=None, checkpointInterval=100):
+        """Continue the run saved at path up to self.generation generations, exactly as if it had
+        never stopped. The GA must be created with the same parameters as the saved run.
+        timeBudget counts from the call to resume."""
+        generation, last_improvement = self.load_checkpoint(path)
+        if self.workers:
+            self.pool = PoolScorer(self.fitness, self.workers, self.chunkSize, batch=self.vectorised)
+        start = time.perf_counter()
+        try:
+            self.run_generations(generation + 1, last_improvement, start, timeBudget, stallGenerations,
+                                 checkpointPath, checkpointInterval)
+        finally:
+            if self.pool is not None:
+                self.pool.close()
+                self.pool = None
+        return self.best_so_far()
+
+    def run_generations(self, first, last_improvement, start, timeBudget, stallGenerations, checkpointPath,
+                        checkpointInterval):
+        """Evolve generations first to self.generation, the main loop of execute and resume"""
+        generation = first - 1
+        for generation in range(first, self.generation + 1):
+            self.evolve_generation()
+            if self.record_generation(generation, start):
+                last_improvement = generation
+            if timeBudget is not None and time.perf_counter() - start >= timeBudget:
+                break
+            if stallGenerations is not None and generation - last_improvement >= stallGenerations:
+                break
+            if checkpointPath is not None and generation % checkpointInterval == 0:
+                self.save_checkpoint(checkpointPath, generation, last_improvement)
+        if checkpointPath is not None:
+            self.save_checkpoint(checkpointPath, generation, last_improvement)
+
+    def save_checkpoint(self, path, generation, last_improvement):
+        """Write the population, the fitness cache, the best layout, the telemetry and the
+        state of the random module to path as a compressed .npz file. The file is replaced
+        atomically so a run killed mid write keeps its previous checkpoint."""
+        cache = self.fitness_cache
+        if self.vectorised:
+            population = self.population
+            cached = np.frombuffer(b"".join(cache.entries), dtype=np.int8).reshape(-1, 40)
+        else:
+            population = encode_population(self.population)
+            rank_of = pieces.RANK_OF
+            cached = np.array([[rank_of[p] for p in key] for key in cache.entries], dtype=np.int8).reshape(-1, 40)
+        version, state, gauss = random.getstate()
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez_compressed(
+                f,
+                counters=np.array([generation, last_improvement, self.populationSize, int(self.vectorised),
+                                   cache.hits, cache.misses, version], dtype=np.int64),
+                population=population,
+                cache_layouts=cached,
+                cache_scores=np.array(list(cache.entries.values())),
+                best_board=encode_population([self.best_board]),
+                best_score=np.array([self.best_score]),
+                stats=np.array([[row[field] for field in STATS_FIELDS] for row in self.stats], dtype=np.float64),
+                rng_state=np.array(state, dtype=np.uint32),
+                rng_gauss=np.array([np.nan if gauss is None else gauss]))
+        os.replace(tmp, path)
+
+    def load_checkpoint(self, path):
+        """Restore the run saved by save_checkpoint, returns (generation, last_improvement)"""
+        with np.load(path) as data:
+            generation, last_improvement, population_size, vectorised, hits, misses, version = data["counters"].tolist()
+            if population_size != self.populationSize or bool(vectorised) != self.vectorised:
+                raise Exception(f"CheckpointMismatch {path} was saved with populationSize {population_size} "
+                                f"and vectorised {bool(vectorised)}")
+            if self.vectorised:
+                self.population = data["population"]
+                keys = [layout.tobytes() for layout in data["cache_layouts"]]
+            else:
+                self.population = decode_population(data["population"])
+                names = pieces.RANK_NAMES
+                keys = [tuple(names[t] for t in layout) for layout in data["cache_layouts"].tolist()]
+            cache = self.fitness_cache
+            cache.entries = OrderedDict(zip(keys, data["cache_scores"].tolist()))
+            cache.hits, cache.misses = hits, misses
+            self.best_board = decode_population(data["best_board"])[0]
+            self.best_score = data["best_score"].tolist()[0]
+            self.stats = [dict(zip(STATS_FIELDS, row)) for row in data["stats"].tolist()]
+            for row in self.stats:
+                row["generation"] = int(row["generation"])
+            gauss = data["rng_gauss"].tolist()[0]
+            random.setstate((version, tuple(data["rng_state"].tolist()), None if gauss != gauss else gauss))
+        return generation, last_improvement
+
+    def evolve_generation(self):
+        self.population = self.select()
+        self.sort_population()
+        self.crossover()
+
+    def emigrants(self, n):
+        """Returns the n fittest members of the population as a (n, 4, 10) array of piece types"""
+        scores = self.population_scores()
+        best = sorted(range(len(scores)), key=scores.__getitem__, reverse=True)[:n]
+        if self.vectorised:
+            return self.population[best]
+        return encode_population(self.take(best))
+
+    def immigrate(self, array):
+        """Replace the least fit members of the population with the layouts of a (n, 4, 10)
+        array of piece types"""
+        scores = self.population_scores()
+        worst = sorted(range(len(scores)), key=scores.__getitem__)[:len(array)]
+        for i, layout in zip(worst, array if self.vectorised else decode_population(array)):
+            self.population[i] = layout
+
+    def record_generation(self, generation, start):
+        """Update the best layout so far and append the generation's best, mean and diversity
+        (fraction of distinct layouts) to self.stats. Returns True if the best score improved."""
+        scores = self.population_scores()
+        meter = utils.RollingMeter()
+        for score in scores:
+            meter.push(score)
+        improved = False
+        if self.best_score is None or meter.max > self.best_score:
+            best = scores.index(meter.max)
+            if self.vectorised:
+                self.best_board = decode_population(self.population[best:best + 1])[0]
+            else:
+                self.best_board = [row[:] for row in self.population[best]]
+            self.best_score = meter.max
+            improved = True
+        diversity = len(set(layout_key(board) for board in self.population)) / len(self.population)
+        self.stats.append({"generation": generation,
+                           "best": meter.max,
+                           "mean": meter.avg,
+                           "diversity": diversity,
+                           "best_so_far": self.best_score,
+                           "seconds": time.perf_counter() - start})
+        return improved
+
+    def best_so_far(self):
+        """Returns (layout, score) of the best layout seen by execute so far"""
+        return self.best_board, self.best_score
+
+    def write_stats(self, path):
+        """Write the per-generation telemetry to path as CSV"""
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=STATS_FIELDS)
+            writer.writeheader()
+            writer.writerows(self.stats)
 
     def get_best_board(self):
         maximum = -1
         bestboard = []
-        for board in self.population:
-            score = self.evaluate(board)
+        for board, score in zip(self.layouts(), self.population_scores()):
             if score > maximum:
                 maximum = score
                 bestboard = board
@@ -189,16 +533,6 @@ def random_swap_list(list1 , list2):
     return list2, list1
 
 
-def compare(board1, board2):
-    if (evaluate(board1) < evaluate(board2)):
-        return -1
-    elif (evaluate(board1) > evaluate(board2)):
-        return 1
-    else:
-        return 0 
-
-
-
 def main():
 
     ga = genetic_algoritgm(100, 10000, 0.4, 0.6)
@@ -0,0 +1,105 @@
+"""Sampling of hidden enemy pieces consistent with what is known about them.
+
+Every hidden square allows a set of piece types (from the Spy) and the enemy has a known
+number of pieces of each type left. A draw gives every square one of its types without using
+more pieces of a type than are left.
+
+Squares allowing a single type are assigned up front, which can use up a type and narrow
+other squares in turn. The remaining squares are filled most constrained first. Each candidate
+type is picked with probability proportional to the pieces of that type left, and is only kept
+if the squares still to fill can be completed (Hall's condition, checked over the 4096 sets of
+piece types). A draw therefore never backtracks: it takes at most one feasibility test per
+square and type, however few consistent setups there are.
+"""
+import random
+from collections import Counter
+
+import numpy as np
+
+import pieces
+
+TYPE_SETS = 1 << pieces.NUM_TYPES
+# MEMBERS[s][t] is 1 if piece type t is in the set of types s (a bitmask)
+MEMBERS = (np.arange(TYPE_SETS)[:, None] >> np.arange(pieces.NUM_TYPES)) & 1
+# Up to this many groups of squares fits checks the subsets of the groups instead
+FEW_GROUPS = 5
+
+
+def fits(groups, counts):
+    """Returns True if every square can get a type. groups maps a bitmask of allowed types to
+    the number of squares allowing exactly those, counts lists the pieces left of each type.
+    By Hall's condition they fit if, for every set of types, the squares allowing only types of
+    the set do not outnumber the pieces of those types left."""
+    items = [(mask, n) for mask, n in groups.items() if n]
+    if len(items) <= FEW_GROUPS:
+        # Cheaper to check the unions of every subset of the groups directly
+        for subset in range(1, 1 << len(items)):
+            need = 0
+            union = 0
+            for j, (mask, n) in enumerate(items):
+                if subset >> j & 1:
+                    need += n
+                    union |= mask
+            if need > sum(n for t, n in enumerate(counts) if union >> t & 1):
+                return False
+        return True
+    need = np.zeros(TYPE_SETS, dtype=np.int64)
+    for mask, n in items:
+        need[mask] += n
+    # Sum over subsets: need[s] becomes the number of squares whose mask is within s
+    for t in range(pieces.NUM_TYPES):
+        sets = need.reshape(-1, 2, 1 << t)
+        sets[:, 1, :] += sets[:, 0, :]
+    return bool((need <= MEMBERS @ np.asarray(counts)).all())
+
+
+class ConstraintSampler:
+
+    def __init__(self, allowed, counts):
+        """allowed lists the possible piece types of every hidden square, counts maps piece
+        types to the number of pieces of that type left"""
+        self.counts = [max(0, counts.get(t, 0)) for t in range(pieces.NUM_TYPES)]
+        masks = [sum(1 << t for t in set(a) if self.counts[t]) for a in allowed]
+        self.forced = [None] * len(masks)
+        # Propagate single type squares until none are left
+        changed = True
+        while changed:
+            changed = False
+            for i, mask in enumerate(masks):
+                if self.forced[i] is None and mask and mask & (mask - 1) == 0:
+                    t = mask.bit_length() - 1
+                    if self.counts[t] == 0:
+                        raise Exception(f"InconsistentEnemySetup no {pieces.RANK_NAMES[t]} left")
+                    self.forced[i] = t
+                    self.counts[t] -= 1
+                    if self.counts[t] == 0:
+                        masks = [m & ~(1 << t) if self.forced[j] is None else m for j, m in enumerate(masks)]
+                    changed = True
+        self.masks = masks
+        self.free = sorted((i for i in range(len(masks)) if self.forced[i] is None),
+                           key=lambda i: bin(masks[i]).count("1"))
+        if any(masks[i] == 0 for i in self.free) or not fits(Counter(masks[i] for i in self.free), self.counts):
+            raise Exception("InconsistentEnemySetup no setup fits the known pieces")
+
+    def sample(self, rng=random):
+        """Returns one consistent piece type for every square"""
+        types = self.forced[:]
+        counts = self.counts[:]
+        groups = Counter(self.masks[i] for i in self.free)
+        for i in self.free:
+            mask = self.masks[i]
+            groups[mask] -= 1
+            candidates = [t for t in range(pieces.NUM_TYPES) if mask >> t & 1 and counts[t]]
+            while True:
+                t = rng.choices(candidates, [counts[c] for c in candidates])[0]
+                counts[t] -= 1
+                if fits(groups, counts):
+                    break
+                counts[t] += 1
+                candidates.remove(t)
+            types[i] = t
+        return types
+
+    def samples(self, n, rng=random):
+        """Returns n draws, see sample"""
+        return [self.sample(rng) for _ in range(n)]
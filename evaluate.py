@@ -1,3 +1,6 @@
+import numpy as np
+import pieces
+
 def evaluate(board):
     return defense_around_flag(board)
 
@@ -10,8 +13,11 @@ def get_flag_location(board):
     return -1, -1
 
 def defense_around_flag(board):
+    """A missing flag or marshal adds nothing to the terms that involve it"""
     score = 0
     flagx, flagy = get_flag_location(board)
+    if flagx < 0:
+        return score
     if flagx == 0:
         score += 100
     score += abs(5- flagy) * 10
@@ -22,8 +28,9 @@ def defense_around_flag(board):
             score += 20
     
     marshalx , marshaly = get_marshal_loaction(board)
-    dis = (abs(flagx - marshalx) + abs(flagy - marshaly))
-    score+= abs(14 - dis) * 10
+    if marshalx >= 0:
+        dis = (abs(flagx - marshalx) + abs(flagy - marshaly))
+        score+= abs(14 - dis) * 10
     return score
     
 
@@ -41,4 +48,200 @@ def get_marshal_loaction(board):
     for i in range(4):
         for j in range(10):
             if (board[i][j] == "one"):
-                return i, j
\ No newline at end of file
+                return i, j
+
+    return -1, -1
+
+def evaluate_batch(layouts):
+    """Vectorised evaluate for a (P, 4, 10) array of piece types (see pieces.py),
+    returns the (P,) array of scores"""
+    return defense_around_flag_batch(layouts)
+
+
+def first_location_batch(flat, piece_type):
+    """Row and column arrays of the first piece_type in each flattened layout, -1 if missing"""
+    found = flat == piece_type
+    index = found.argmax(axis=1)
+    present = found.any(axis=1)
+    return np.where(present, index // 10, -1), np.where(present, index % 10, -1)
+
+
+def defense_around_flag_batch(layouts):
+    """Same score as defense_around_flag for a whole population at once"""
+    flat = np.asarray(layouts).reshape(-1, 40)
+    rows = np.arange(40) // 10
+    columns = np.arange(40) % 10
+
+    flagx, flagy = first_location_batch(flat, pieces.FLAG)
+    has_flag = flagx >= 0
+    score = np.where(flagx == 0, 100, 0)
+    score += np.where(has_flag, np.abs(5 - flagy) * 10, 0)
+
+    near_flag = (np.abs(rows - flagx[:, None]) <= 1) & (np.abs(columns - flagy[:, None]) <= 1) & has_flag[:, None]
+    score += ((flat == pieces.BOMB) & near_flag).sum(axis=1) * 20
+
+    marshalx, marshaly = first_location_batch(flat, pieces.MARSHALL)
+    dis = np.abs(flagx - marshalx) + np.abs(flagy - marshaly)
+    score += np.where(has_flag & (marshalx >= 0), np.abs(14 - dis) * 10, 0)
+    return score
+
+
+# Pluggable setup features.
+#
+# A layout is scanned once into the list of squares (row * 10 + column) held by every piece
+# type, or for a batch into a (P, 40, piece types) boolean mask. Each feature is computed from
+# that instead of walking the layout again. Register new features with register_feature.
+
+SQUARE_ROWS = np.arange(40) // 10
+SQUARE_COLUMNS = np.arange(40) % 10
+FRONT_ROW = 3
+
+FEATURES = {}
+
+
+def register_feature(name, single, batch):
+    """single(positions) returns the feature of one layout, batch(masks) returns the (P,) feature
+    of a whole batch, see layout_positions and layout_masks"""
+    FEATURES[name] = (single, batch)
+
+
+def layout_positions(board):
+    """Single pass over a layout (4 x 10 rows of piece names or 40 piece types) returning the
+    squares of every piece type"""
+    positions = [[] for _ in range(pieces.NUM_TYPES)]
+    if len(board) == 4:
+        rank_of = pieces.RANK_OF
+        board = [rank_of[name] for row in board for name in row]
+    for square, t in enumerate(board):
+        positions[t].append(square)
+    return positions
+
+
+def layout_masks(layouts):
+    """(P, 40, piece types) boolean masks of a (P, 4, 10) array of piece types"""
+    flat = np.asarray(layouts).reshape(-1, 40)
+    return flat[:, :, None] == np.arange(pieces.NUM_TYPES)
+
+
+def first_square(positions, piece_type):
+    squares = positions[piece_type]
+    return squares[0] if squares else None
+
+
+def first_square_batch(masks, piece_type):
+    found = masks[:, :, piece_type]
+    return np.where(found.any(axis=1), found.argmax(axis=1), -1)
+
+
+def distance(positions, a, b):
+    """Manhattan distance between the first pieces of types a and b, -1 if either is missing"""
+    x, y = first_square(positions, a), first_square(positions, b)
+    if x is None or y is None:
+        return -1
+    return abs(x // 10 - y // 10) + abs(x % 10 - y % 10)
+
+
+def distance_batch(masks, a, b):
+    x, y = first_square_batch(masks, a), first_square_batch(masks, b)
+    d = np.abs(x // 10 - y // 10) + np.abs(x % 10 - y % 10)
+    return np.where((x < 0) | (y < 0), -1, d)
+
+
+def flag_row(positions):
+    f = first_square(positions, pieces.FLAG)
+    return -1 if f is None else f // 10
+
+
+def flag_column(positions):
+    f = first_square(positions, pieces.FLAG)
+    return -1 if f is None else f % 10
+
+
+def flag_row_batch(masks):
+    f = first_square_batch(masks, pieces.FLAG)
+    return np.where(f < 0, -1, f // 10)
+
+
+def flag_column_batch(masks):
+    f = first_square_batch(masks, pieces.FLAG)
+    return np.where(f < 0, -1, f % 10)
+
+
+def bombs_near_flag(positions):
+    f = first_square(positions, pieces.FLAG)
+    if f is None:
+        return 0
+    return sum(1 for b in positions[pieces.BOMB] if abs(b // 10 - f // 10) <= 1 and abs(b % 10 - f % 10) <= 1)
+
+
+def bombs_near_flag_batch(masks):
+    f = first_square_batch(masks, pieces.FLAG)
+    near = (np.abs(SQUARE_ROWS - (f // 10)[:, None]) <= 1) & (np.abs(SQUARE_COLUMNS - (f % 10)[:, None]) <= 1)
+    return np.where(f < 0, 0, (masks[:, :, pieces.BOMB] & near).sum(axis=1))
+
+
+def distance_offset(d):
+    """The 14 - distance term of defense_around_flag, 0 when a piece is missing"""
+    return 0 if d < 0 else abs(14 - d)
+
+
+register_feature("flag_row", flag_row, flag_row_batch)
+register_feature("flag_column", flag_column, flag_column_batch)
+register_feature("flag_on_back_row",
+                 lambda p: int(flag_row(p) == 0),
+                 lambda m: (flag_row_batch(m) == 0).astype(int))
+register_feature("flag_column_offset",
+                 lambda p: 0 if flag_column(p) < 0 else abs(5 - flag_column(p)),
+                 lambda m: np.where(flag_column_batch(m) < 0, 0, np.abs(5 - flag_column_batch(m))))
+register_feature("bombs_near_flag", bombs_near_flag, bombs_near_flag_batch)
+register_feature("marshal_distance",
+                 lambda p: distance(p, pieces.FLAG, pieces.MARSHALL),
+                 lambda m: distance_batch(m, pieces.FLAG, pieces.MARSHALL))
+register_feature("marshal_distance_offset",
+                 lambda p: distance_offset(distance(p, pieces.FLAG, pieces.MARSHALL)),
+                 lambda m: np.where(distance_batch(m, pieces.FLAG, pieces.MARSHALL) < 0, 0,
+                                    np.abs(14 - distance_batch(m, pieces.FLAG, pieces.MARSHALL))))
+register_feature("general_distance",
+                 lambda p: distance(p, pieces.FLAG, pieces.RANK_OF["two"]),
+                 lambda m: distance_batch(m, pieces.FLAG, pieces.RANK_OF["two"]))
+register_feature("front_row_scouts",
+                 lambda p: sum(1 for s in p[pieces.SCOUT] if s // 10 == FRONT_ROW),
+                 lambda m: m[:, SQUARE_ROWS == FRONT_ROW, pieces.SCOUT].sum(axis=1))
+for _row in range(4):
+    register_feature(f"miners_row_{_row}",
+                     lambda p, row=_row: sum(1 for s in p[pieces.MINER] if s // 10 == row),
+                     lambda m, row=_row: m[:, SQUARE_ROWS == row, pieces.MINER].sum(axis=1))
+del _row
+
+# Weights under which SetupEvaluator scores a layout like defense_around_flag
+DEFAULT_WEIGHTS = {"flag_on_back_row": 100,
+                   "flag_column_offset": 10,
+                   "bombs_near_flag": 20,
+                   "marshal_distance_offset": 10}
+
+
+class SetupEvaluator:
+
+    def __init__(self, weights=None, features=None):
+        """Scores layouts as the weighted sum of a feature vector. weights maps feature names to
+        weights (missing features weigh 0), features lists the features to extract, by default
+        every registered feature."""
+        self.names = list(features or FEATURES)
+        weights = DEFAULT_WEIGHTS if weights is None else weights
+        self.weights = np.array([weights.get(name, 0) for name in self.names], dtype=float)
+
+    def features(self, board):
+        """Feature vector of a single layout, in the order of self.names"""
+        positions = layout_positions(board)
+        return [FEATURES[name][0](positions) for name in self.names]
+
+    def features_batch(self, layouts):
+        """(P, features) array for a (P, 4, 10) array of piece types"""
+        masks = layout_masks(layouts)
+        return np.stack([FEATURES[name][1](masks) for name in self.names], axis=1)
+
+    def __call__(self, board):
+        return float(np.dot(self.weights, self.features(board)))
+
+    def score_batch(self, layouts):
+        return self.features_batch(layouts) @ self.weights
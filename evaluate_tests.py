@@ -0,0 +1,69 @@
+import unittest
+import evaluate
+from GeneticAlgorithm import genetic_algoritgm, encode_population
+
+
+class TestSetupEvaluator(unittest.TestCase):
+
+    def setUp(self):
+        ga = genetic_algoritgm(10, 1, 0.4, 0.6)
+        self.boards = [ga.random_board_layout() for _ in range(100)]
+        self.array = encode_population(self.boards)
+
+    def test_default_weights_match_evaluate(self):
+        evaluator = evaluate.SetupEvaluator()
+        self.assertEqual([evaluate.evaluate(board) for board in self.boards], [evaluator(board) for board in self.boards])
+        self.assertEqual(evaluate.evaluate_batch(self.array).tolist(), evaluator.score_batch(self.array).tolist())
+
+    def test_single_and_batch_features_agree(self):
+        evaluator = evaluate.SetupEvaluator()
+        batch = evaluator.features_batch(self.array)
+        self.assertEqual((100, len(evaluator.names)), batch.shape)
+        for board, row in zip(self.boards, batch.tolist()):
+            self.assertEqual(evaluator.features(board), row)
+
+    def test_features(self):
+        board = [["flag", "bomb", "one", "nine"] + ["five"] * 6,
+                 ["bomb", "bomb", "eight"] + ["six"] * 7,
+                 ["two"] + ["seven"] * 9,
+                 ["nine", "nine", "eight", "spy"] + ["four"] * 6]
+        evaluator = evaluate.SetupEvaluator(features=["flag_row", "flag_column", "bombs_near_flag",
+                                                        "marshal_distance", "general_distance",
+                                                        "front_row_scouts", "miners_row_1", "miners_row_3"])
+        self.assertEqual([0, 0, 3, 2, 2, 2, 1, 1], evaluator.features(board))
+
+    def test_missing_pieces(self):
+        evaluator = evaluate.SetupEvaluator()
+        for missing in ["one", "flag"]:
+            boards = []
+            for board in self.boards[:20]:
+                board = [row[:] for row in board]
+                for row in board:
+                    for j, piece in enumerate(row):
+                        if piece == missing:
+                            row[j] = "two"
+                boards.append(board)
+            array = encode_population(boards)
+            features = dict(zip(evaluator.names, evaluator.features(boards[0])))
+            self.assertEqual(-1, features["marshal_distance"])
+            self.assertEqual(evaluator.features(boards[0]), evaluator.features_batch(array)[0].tolist())
+            scores = [evaluate.evaluate(board) for board in boards]
+            self.assertEqual(scores, [evaluator(board) for board in boards])
+            self.assertEqual(scores, evaluate.evaluate_batch(array).tolist())
+            self.assertEqual(scores, evaluator.score_batch(array).tolist())
+
+    def test_custom_feature_and_weights(self):
+        evaluate.register_feature("spies", lambda p: len(p[1]), lambda m: m[:, :, 1].sum(axis=1))
+        try:
+            evaluator = evaluate.SetupEvaluator(weights={"spies": 2.5, "front_row_scouts": 1})
+            board = self.boards[0]
+            features = dict(zip(evaluator.names, evaluator.features(board)))
+            self.assertEqual(1, features["spies"])
+            self.assertEqual(2.5 + features["front_row_scouts"], evaluator(board))
+            self.assertEqual(evaluator(board), evaluator.score_batch(self.array[:1])[0])
+        finally:
+            del evaluate.FEATURES["spies"]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,231 @@
+import csv
+import os
+import random
+import tempfile
+import unittest
+import selection
+from islands import run_islands
+from evaluate import evaluate, evaluate_batch
+from GeneticAlgorithm import genetic_algoritgm, FitnessCache, is_board_valid, encode_population, decode_population
+
+
+def failing_fitness(board):
+    raise ValueError("fitness failed")
+
+
+class TestFitnessCache(unittest.TestCase):
+
+    def test_layouts_are_scored_once(self):
+        calls = []
+        def fitness(board):
+            calls.append(board)
+            return evaluate(board)
+        cache = FitnessCache(fitness)
+        ga = genetic_algoritgm(10, 1, 0.4, 0.6)
+        board = ga.random_board_layout()
+        self.assertEqual(evaluate(board), cache(board))
+        self.assertEqual(evaluate(board), cache([row[:] for row in board]))
+        self.assertEqual(1, len(calls))
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+
+    def test_cache_is_bounded(self):
+        cache = FitnessCache(evaluate, max_size=3)
+        ga = genetic_algoritgm(10, 1, 0.4, 0.6)
+        boards = [ga.random_board_layout() for _ in range(5)]
+        for board in boards:
+            cache(board)
+        self.assertEqual(3, len(cache))
+        cache(boards[0])
+        self.assertEqual(6, cache.misses, "Oldest layout should have been evicted")
+
+class TestGeneticAlgorithm(unittest.TestCase):
+
+    def test_population_sorted_by_fitness(self):
+        ga = genetic_algoritgm(20, 5, 0.4, 0.6)
+        ga.createPopulation()
+        scores = [evaluate(board) for board in ga.population]
+        self.assertEqual(sorted(scores), scores)
+
+    def test_execute_keeps_layouts_valid(self):
+        random.seed(1)
+        ga = genetic_algoritgm(20, 5, 0.4, 0.6)
+        ga.execute()
+        for board in ga.population:
+            self.assertTrue(is_board_valid(board))
+
+    def test_parallel_fitness_is_deterministic(self):
+        for vectorised in [False, True]:
+            results = []
+            for workers in [None, 1, 3]:
+                random.seed(7)
+                ga = genetic_algoritgm(40, 5, 0.4, 0.6, vectorised=vectorised, workers=workers, chunkSize=4)
+                ga.execute()
+                results.append(ga.layouts())
+            self.assertEqual(results[0], results[1])
+            self.assertEqual(results[0], results[2])
+
+    def test_execute_returns_best_so_far(self):
+        random.seed(3)
+        ga = genetic_algoritgm(20, 30, 0.4, 0.6)
+        board, score = ga.execute()
+        self.assertEqual(evaluate(board), score)
+        self.assertEqual(31, len(ga.stats))
+        self.assertEqual(score, max(row["best"] for row in ga.stats))
+        for row in ga.stats:
+            self.assertLessEqual(row["mean"], row["best"])
+            self.assertTrue(0 < row["diversity"] <= 1)
+
+    def test_stall_and_time_budget(self):
+        ga = genetic_algoritgm(20, 10000, 0.4, 0.6)
+        ga.execute(stallGenerations=5)
+        improvements = [row["generation"] for previous, row in zip(ga.stats, ga.stats[1:])
+                        if row["best_so_far"] > previous["best_so_far"]]
+        self.assertEqual(5, ga.stats[-1]["generation"] - max(improvements, default=0))
+
+        ga = genetic_algoritgm(20, 10 ** 9, 0.4, 0.6)
+        board, score = ga.execute(timeBudget=0.05)
+        self.assertTrue(is_board_valid(board))
+        self.assertLess(ga.stats[-1]["seconds"], 1.0)
+
+    def test_resume_matches_an_uninterrupted_run(self):
+        for vectorised in [False, True]:
+            random.seed(11)
+            ga = genetic_algoritgm(20, 12, 0.4, 0.6, vectorised=vectorised)
+            expected = ga.execute()
+            with tempfile.TemporaryDirectory() as d:
+                path = os.path.join(d, "run.npz")
+                random.seed(11)
+                genetic_algoritgm(20, 7, 0.4, 0.6, vectorised=vectorised).execute(
+                    checkpointPath=path, checkpointInterval=5)
+                random.seed(99)
+                resumed = genetic_algoritgm(20, 12, 0.4, 0.6, vectorised=vectorised)
+                self.assertEqual(expected, resumed.resume(path))
+                self.assertEqual(ga.layouts(), resumed.layouts())
+                self.assertEqual([row["best"] for row in ga.stats], [row["best"] for row in resumed.stats])
+                self.assertEqual(ga.fitness_cache.entries, resumed.fitness_cache.entries)
+
+    def test_write_stats(self):
+        ga = genetic_algoritgm(10, 3, 0.4, 0.6)
+        ga.execute()
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "stats.csv")
+            ga.write_stats(path)
+            with open(path) as f:
+                rows = list(csv.DictReader(f))
+        self.assertEqual(4, len(rows))
+        self.assertEqual(["generation", "best", "mean", "diversity", "best_so_far", "seconds"], list(rows[0].keys()))
+
+    def test_migration(self):
+        for vectorised in [False, True]:
+            source = genetic_algoritgm(10, 1, 0.4, 0.6, vectorised=vectorised)
+            source.createPopulation()
+            target = genetic_algoritgm(10, 1, 0.4, 0.6, vectorised=vectorised)
+            target.createPopulation()
+            migrants = source.emigrants(3)
+            self.assertEqual((3, 4, 10), migrants.shape)
+            self.assertEqual(sorted(source.population_scores())[-3:][::-1],
+                             [evaluate(board) for board in decode_population(migrants)])
+            worst = sorted(target.population_scores())[3:]
+            target.immigrate(migrants)
+            self.assertEqual(10, len(target.population))
+            self.assertEqual(sorted(worst + sorted(source.population_scores())[-3:]),
+                             sorted(target.population_scores()))
+
+
+class TestIslands(unittest.TestCase):
+
+    def test_merged_pool(self):
+        pool = run_islands(3, 12, migration_interval=4, migrants=2, seed=11,
+                           populationSize=15, mutationRate=0.4, crossoverRate=0.6)
+        scores = [score for score, _ in pool]
+        self.assertEqual(sorted(scores, reverse=True), scores)
+        layouts = [tuple(map(tuple, board)) for _, board in pool]
+        self.assertEqual(len(layouts), len(set(layouts)))
+        for score, board in pool:
+            self.assertTrue(is_board_valid(board))
+            self.assertEqual(evaluate(board), score)
+
+    def test_large_migrant_batches(self):
+        # Batches far larger than a pipe's buffer must not block the ring
+        pool = run_islands(2, 3, migration_interval=1, migrants=3000, seed=1, populationSize=3000,
+                           mutationRate=0.4, crossoverRate=0.6, vectorised=True)
+        self.assertGreater(len(pool), 3000)
+
+    def test_failed_island_raises(self):
+        with self.assertRaisesRegex(Exception, "IslandFailed"):
+            run_islands(2, 3, seed=1)
+        with self.assertRaisesRegex(Exception, "IslandFailed"):
+            run_islands(2, 20, migration_interval=2, seed=1, populationSize=10, mutationRate=0.4,
+                        crossoverRate=0.6, fitness=failing_fitness)
+
+    def test_deterministic_under_seed(self):
+        first = run_islands(2, 6, migration_interval=2, seed=5, populationSize=10, mutationRate=0.4, crossoverRate=0.6)
+        second = run_islands(2, 6, migration_interval=2, seed=5, populationSize=10, mutationRate=0.4, crossoverRate=0.6)
+        self.assertEqual(first, second)
+
+
+class TestSelection(unittest.TestCase):
+
+    def test_exact_counts(self):
+        weights = [i + 1 for i in range(50)]
+        for n in [1, 50, 200]:
+            self.assertEqual(n, len(selection.roulette(weights, n)))
+            self.assertEqual(n, len(selection.stochastic_universal(weights, n)))
+            self.assertEqual(n, len(selection.tournament(weights, n)))
+
+    def test_zero_weights_are_never_picked(self):
+        weights = [0, 1, 0, 3, 0]
+        for i in selection.roulette(weights, 1000) + selection.stochastic_universal(weights, 1000):
+            self.assertIn(i, [1, 3])
+
+    def test_stochastic_universal_spread(self):
+        weights = [1, 2, 3, 4]
+        picks = selection.stochastic_universal(weights, 100)
+        for i, w in enumerate(weights):
+            expected = 100 * w / sum(weights)
+            self.assertLessEqual(abs(picks.count(i) - expected), 1)
+
+    def test_tournament_prefers_fitter(self):
+        scores = [5, 1, 9, 3]
+        self.assertEqual([2] * 10, selection.tournament(scores, 10, size=200))
+
+    def test_population_size_is_constant(self):
+        for scheme in ["roulette", "sus", "tournament"]:
+            for vectorised in [False, True]:
+                ga = genetic_algoritgm(25, 10, 0.4, 0.6, vectorised=vectorised, selection=scheme)
+                ga.execute()
+                self.assertEqual(25, len(ga.population), scheme)
+
+
+class TestBatchEvaluate(unittest.TestCase):
+
+    def test_matches_evaluate(self):
+        ga = genetic_algoritgm(10, 1, 0.4, 0.6)
+        boards = [ga.random_board_layout() for _ in range(200)]
+        no_flag = [row[:] for row in boards[0]]
+        for row in no_flag:
+            for j, piece in enumerate(row):
+                if piece == "flag":
+                    row[j] = "bomb"
+        boards.append(no_flag)
+        array = encode_population(boards)
+        self.assertEqual((201, 4, 10), array.shape)
+        self.assertEqual(boards, decode_population(array))
+        self.assertEqual([evaluate(board) for board in boards], evaluate_batch(array).tolist())
+
+    def test_vectorised_population(self):
+        random.seed(2)
+        ga = genetic_algoritgm(30, 3, 0.4, 0.6, vectorised=True)
+        ga.createPopulation()
+        self.assertEqual((30, 4, 10), ga.population.shape)
+        scores = [evaluate(board) for board in ga.layouts()]
+        self.assertEqual(sorted(scores), scores)
+        ga.execute()
+        for board in ga.layouts():
+            self.assertTrue(is_board_valid(board))
+        board, score = ga.get_best_board()
+        self.assertEqual(evaluate(board), score)
+
+
+if __name__ == '__main__':
+    unittest.main()
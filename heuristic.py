@@ -1,349 +1,669 @@
 import random
-from spy import Spy
-import copy
-from scipy import spatial
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
+import pieces
+import setup_generator
+from determinisation import ConstraintSampler
+import stratego
 import utils
+from transposition import TranspositionTable, EXACT, LOWER, UPPER
 
-class Heuristic:
-    def __init__(self, board):
-        self.board = board
-        self.starting_quantities = Spy(self.board)
+# Material value of every piece type (see pieces.py). The flag has no material value,
+# capturing it ends the game and scores WIN instead.
+PIECE_VALUES = [0, 30, 10, 25, 15, 20, 25, 35, 50, 75, 100, 20]
+WIN = 100000
+MAX_PLY = 64
 
-    def evaluate(self):
-        current_board = self.board
-        starting_quantities = self.starting_quantities
-        score = 0
-        for key in starting_quantities.keys():
-            score += abs(current_board[key] - starting_quantities[key])
-        return score
 
-    def get_best_board(self):
-        maximum = -1
-        bestboard = []
-        for board in self.population:
-            score = self.evaluate(board)
-            if score > maximum:
-                maximum = score
-                bestboard = board
-        return bestboard, maximum
-
-    def random_swap_list(self, list1 , list2):
-        r = random.random()
-        if r <= 0.5:
-            return list1, list2
-        return list2, list1
-
-    def compare(self, board1, board2):
-        if (self.evaluate(board1) < self.evaluate(board2)):
-            return -1
-        elif (self.evaluate(board1) > self.evaluate(board2)):
-            return 1
-        else:
-            return 0
+class SearchAborted(Exception):
+    """Raised inside MinMax.search when the time or node budget runs out"""
+
+
+def value_of(c):
+    """Material value of the piece with cell code c (0 for an empty cell)"""
+    return PIECE_VALUES[(c & pieces.TYPE_MASK) - 1] if c else 0
+
+
+def capture_gain(attacker, defender):
+    """Material the attacker's side gains by attacking defender, by the battle table"""
+    outcome = stratego.battle_table[(attacker & pieces.TYPE_MASK) - 1][(defender & pieces.TYPE_MASK) - 1]
+    if outcome == utils.ATTACKER_WINS:
+        return value_of(defender)
+    if outcome == utils.DEFENDER_WINS:
+        return -value_of(attacker)
+    return value_of(defender) - value_of(attacker)
+
+
+# Fight outcomes and OUTCOME_MASKS[k][attacker type][defender type], 1.0 where the battle table
+# gives OUTCOMES[k]
+OUTCOMES = (utils.ATTACKER_WINS, utils.DEFENDER_WINS, utils.BOTH_DIE)
+OUTCOME_MASKS = np.stack([(utils.get_bm() == outcome).astype(np.float64) for outcome in OUTCOMES])
+VALUE_VECTOR = np.array(PIECE_VALUES, dtype=np.float64)
+IMMOBILE_MASK = np.array([0.0 if t in (pieces.FLAG, pieces.BOMB) else 1.0 for t in range(pieces.NUM_TYPES)])
+
+# Engines of a worker process, see search_determinisation
+_worker_engines = {}
 
 
-class MinMax():
-    def __init__(self, board):
-        self.board = board
-        self.starting_quantities = Spy()
+def search_determinisation(color, tt_size_mb, cells, turn, max_depth, time_budget, node_budget, seed):
+    """Process pool task: searches one determinised board, given as its cells and side to
+    move, and returns MinMax.search_position's result with exact root move scores. A worker
+    keeps its engine from task to task, so its tables carry over from move to move."""
+    engine = _worker_engines.get((color, tt_size_mb))
+    if engine is None:
+        engine = _worker_engines[(color, tt_size_mb)] = MinMax(color, tt_size_mb=tt_size_mb)
+    engine.rng = random.Random(seed)
+    board = stratego.Board.from_cells(cells)
+    if board.turn != turn:
+        board.pass_turn()
+    return engine.search_position(board, max_depth, time_budget, node_budget, exact_root=True)
 
-    def __init__(self, team, depth=None):
-        super(MinMax, self).__init__(team=team)
-        # rewards for planning the move
-        self.kill_reward = 10  # killing an enemy piece
-        self.neutral_fight = 2  # a neutral outcome of a fight
-        self.winGameReward = 100  # finding the enemy flag
-        self.certainty_multiplier = 1.2  # killing known, not guessed, enemy pieces
 
-        # initial maximum depth of the minimax algorithm
+class MinMax:
+    def __init__(self, color, depth=None, rng=random, time_budget=None, node_budget=None, tt_size_mb=16,
+                 determinisations=1, workers=None, aggregation="vote"):
+        """Alpha-beta search playing color ("blue" or "red"). depth fixes the search depth in
+        plies, by default it grows as the enemy loses pieces (see set_max_depth). With a
+        time_budget (seconds) or node_budget per move the search deepens until the budget runs
+        out, up to depth plies if given. tt_size_mb is the size of the transposition table,
+        0 searches without one.
+
+        With determinisations > 1 the move is chosen by perfect information Monte Carlo: that
+        many enemy setups are drawn and searched, across workers processes if given, and the
+        root moves are ranked by aggregation, "vote" (most often best, then highest mean score)
+        or "mean" (highest mean score). The budgets are shared between the searches."""
+        self.color = color
+        self.own = pieces.COLORS.index(color)
         self.ext_depth = depth
-        self.max_depth = 2  # standard max depth
+        self.max_depth = 2
+        self.rng = rng
+        self.time_budget = time_budget
+        self.node_budget = node_budget
+        self.deadline = None
+        self.node_limit = None
+        self.determinisations = determinisations
+        self.workers = workers
+        self.aggregation = aggregation
+        self.pool = None
+        # Score of every root move in the last completed iteration. They are exact only when
+        # searching with exact_root, otherwise only the best move's score is.
+        self.root_scores = {}
+        self.exact_root = False
+        # Principal variation found by each search, pv[ply] is the best line from ply on.
+        # The previous iteration's line is searched first by the next one.
+        self.pv = [[] for _ in range(MAX_PLY + 1)]
+        self.previous_pv = []
+        self.follow_pv = False
+        # Kept from move to move, positions searched for one move often come up again
+        self.tt_size_mb = tt_size_mb
+        self.tt = TranspositionTable(tt_size_mb) if tt_size_mb else None
+        # Move ordering: two killer moves per ply and a history score per (source, target)
+        self.killers = [[None, None] for _ in range(MAX_PLY)]
+        self.history = [0] * 10000
+        self.nodes = 0
+        self.root_move = None
+        # One row per decided move: move, score, depth of the last completed iteration,
+        # principal variation, nodes, seconds and the transposition table counts so far.
+        # With determinisations, the lowest depth and the votes of the move.
+        self.stats = []
 
-        # the matrix table for deciding battle outcomes between two pieces
-        self.battleMatrix = utils.get_bm()
+    def decide_move(self, board, spy=None):
+        """Returns the best (row, column, target_row, target_column) move for self.color on
+        board, a Board as seen by this player. Hidden enemy pieces are filled in with
+        draw_consistent_enemy_setup before searching.
 
-    def decide_move(self, state, logic):
-        """
-        Depending on the amount of enemy pieces left, we are entering the start, mid or endgame
-        and planning through the minimax algorithm.
-        :return: tuple of tuple positions representing the move
-        """
-        if self.ext_depth is None:
-            self.set_max_depth()  # set max_depth each turn
-        else:
+        The search deepens one ply at a time. Without a budget it stops at max_depth. With a
+        budget it goes on until the budget runs out, and the move of the last completed
+        iteration is played. The first iteration always completes."""
+        start = time.perf_counter()
+        budgeted = self.time_budget is not None or self.node_budget is not None
+        if self.ext_depth is not None:
             self.max_depth = self.ext_depth
-        # make sure a flag win will be discounted by a factor that guarantees a preference towards immediate flag kill
-        self.winGameReward = max(self.winGameReward, self.max_depth * self.kill_reward)
-        return self.minmax(max_depth=self.max_depth)
-
-    def set_max_depth(self):
-        n_alive_enemies = sum(
-            [True for piece in self.ordered_opp_pieces if not piece.dead]
-        )
-        if 7 < n_alive_enemies <= 10:
-            # one move each player lookahead
-            self.max_depth = 2
-        elif 4 <= n_alive_enemies <= 7:
+        elif budgeted:
+            self.max_depth = MAX_PLY - 1
+        else:
+            self.set_max_depth(board)
+        if self.determinisations > 1:
+            try:
+                row = self.decide_by_sampling(board, spy)
+            except BaseException:
+                # Do not leave the worker processes running after a failed search
+                self.close()
+                raise
+        else:
+            row = self.search_position(self.position_to_search(board, spy), self.max_depth,
+                                       self.time_budget, self.node_budget)
+            del row["root_scores"]
+        row["seconds"] = time.perf_counter() - start
+        if self.tt is not None:
+            row.update(tt_hits=self.tt.hits, tt_stores=self.tt.stores, tt_collisions=self.tt.collisions)
+        self.stats.append(row)
+        return row["move"]
+
+    def position_to_search(self, board, spy=None):
+        """Returns the board to search for board as seen by this player, with the hidden enemy
+        pieces drawn by draw_consistent_enemy_setup"""
+        return self.draw_consistent_enemy_setup(board, spy)
+
+    def search_position(self, board, max_depth, time_budget=None, node_budget=None, exact_root=False):
+        """Iterative deepening search of board, a board without hidden pieces, up to max_depth
+        plies or until the budget runs out. Returns the move, score, depth and principal
+        variation of the last completed iteration, with the nodes searched and root_scores.
+        board itself is left as it is, the search plays its moves on a clone."""
+        board = board.clone()
+        game = stratego.Game()
+        game.board = board
+        if board.turn != self.own:
+            board.pass_turn()
+        self.new_search()
+        self.exact_root = exact_root
+        start = time.perf_counter()
+        material = self.material(board.cells)
+        move, score, depth, root_scores = None, None, 0, {}
+        for iteration in range(1, max_depth + 1):
+            if iteration == 2:
+                if time_budget is not None:
+                    self.deadline = start + time_budget
+                if node_budget is not None:
+                    self.node_limit = node_budget
+            self.follow_pv = True
+            self.root_scores = {}
+            try:
+                result = self.search(game, iteration, -WIN - 1, WIN + 1, 0, material)
+            except SearchAborted:
+                break
+            move, score, depth, root_scores = self.root_move, result, iteration, self.root_scores
+            self.previous_pv = self.pv[0][:]
+            if abs(score) >= WIN - MAX_PLY:
+                # Forced win or loss found, deeper iterations cannot change it
+                break
+            if self.deadline is not None and time.perf_counter() >= self.deadline:
+                break
+        self.deadline = self.node_limit = None
+        self.root_move = move
+        return {"move": move,
+                "score": score,
+                "depth": depth,
+                "pv": self.previous_pv,
+                "nodes": self.nodes,
+                "root_scores": root_scores}
+
+    def decide_by_sampling(self, board, spy=None):
+        """Draws self.determinisations enemy setups, searches each of them and ranks the root
+        moves by self.aggregation. Returns the stats row of the chosen move."""
+        k = self.determinisations
+        boards = self.draw_consistent_enemy_setups(board, spy, k)
+        seeds = [self.rng.getrandbits(64) for _ in range(k)]
+        # The searches run in rounds of one per worker, each gets its round's share of the time
+        rounds = -(-k // (self.workers or 1))
+        time_budget = None if self.time_budget is None else self.time_budget / rounds
+        node_budget = None if self.node_budget is None else max(1, self.node_budget // k)
+        tt_size_mb = 0 if self.tt is None else self.tt_size_mb
+        if self.workers:
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(self.workers)
+            futures = [self.pool.submit(search_determinisation, self.color, tt_size_mb, bytes(b.cells), self.own,
+                                        self.max_depth, time_budget, node_budget, seed)
+                       for b, seed in zip(boards, seeds)]
+            results = [future.result() for future in futures]
+        else:
+            rng = self.rng
+            results = []
+            for b, seed in zip(boards, seeds):
+                self.rng = random.Random(seed)
+                results.append(self.search_position(b, self.max_depth, time_budget, node_budget, exact_root=True))
+            self.rng = rng
+        return self.aggregate(results)
+
+    def aggregate(self, results):
+        """Combines the results of the searches of several determinisations into one stats row"""
+        votes = Counter(result["move"] for result in results)
+        totals = Counter()
+        counts = Counter()
+        for result in results:
+            for move, score in result["root_scores"].items():
+                totals[move] += score
+                counts[move] += 1
+        means = {move: totals[move] / counts[move] for move in counts}
+        if self.aggregation == "mean":
+            move = max(means, key=means.get)
+        elif self.aggregation == "vote":
+            move = max(votes, key=lambda m: (votes[m], means.get(m, -WIN)))
+        else:
+            raise Exception(f"UnknownAggregation {self.aggregation}")
+        pv = next((result["pv"] for result in results if result["move"] == move), [move])
+        return {"move": move,
+                "score": means.get(move),
+                "depth": min(result["depth"] for result in results),
+                "pv": pv,
+                "nodes": sum(result["nodes"] for result in results),
+                "determinisations": len(results),
+                "votes": votes[move]}
+
+    def observe(self, move):
+        """Called with every move played in the game. The search starts afresh each move, so
+        there is nothing to keep."""
+
+    def close(self):
+        """Shut down the worker processes, if any"""
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def new_search(self):
+        """Reset the node count and the killer moves, and age the history scores"""
+        self.nodes = 0
+        self.root_move = None
+        self.previous_pv = []
+        self.killers = [[None, None] for _ in range(MAX_PLY)]
+        self.history = [h >> 1 for h in self.history]
+        if self.tt is not None:
+            self.tt.new_search()
+
+    def set_max_depth(self, board):
+        """Search depth without a budget, deeper as the enemy's 40 pieces thin out"""
+        n_alive_enemies = sum(1 for c in board.cells if c and pieces.color_of(c) != self.own)
+        if n_alive_enemies > 28:
             # two moves each player lookahead
             self.max_depth = 4
-        elif n_alive_enemies <= 3:
+        elif n_alive_enemies >= 12:
+            # three moves each player lookahead
+            self.max_depth = 6
+        else:
             # four moves each player lookahead
             self.max_depth = 8
 
-    def minmax(self, max_depth):
-        """
-        given the maximum depth, copy the known board so far, assign the pieces by random, while still
-        respecting the current knowledge, and then decide the move via minimax algorithm.
-        :param max_depth: int
-        :return: tuple of spatial tuples
-        """
-        curr_board = copy.deepcopy(self.board)
-        curr_board = self.draw_consistent_enemy_setup(curr_board)
-        chosen_action = self.max_val(
-            curr_board, 0, -float("inf"), float("inf"), max_depth
-        )[1]
-        return chosen_action
-
-    def max_val(self, board, current_reward, alpha, beta, depth):
-        """
-        Do the max players step in the minimax algorithm. Check first if the given board is in
-        a terminal state. If not, we will do each possible move once and send the process to
-        min_val to do the min players step.
-        :param board: the current board, numpy array
-        :param current_reward: the current value the path has accumulated
-        :param alpha: alpha threshold of the minimax alg
-        :param beta: beta threshold of the minimax alg
-        :param depth: the depth the process is at, integer
-        :return: tuple of best value, and a associated best_action (float, tuple)
-        """
-        # this is what the expectimax agent will think
-
-        # get my possible actions, then shuffle them to ensure randomness when no action
-        # stands out as the best
-        my_doable_actions = utils.get_poss_moves(board, self.team)
-        np.random.shuffle(my_doable_actions)
-
-        # check for terminal-state scenario
-        done, won = self.goal_test(my_doable_actions, board, max_val=True)
-        if done or depth == 0:
-            return current_reward + self.get_terminal_reward(done, won, depth), None
-
-        val = -float("inf")
-        best_action = None
-        for action in my_doable_actions:
-            board, fight_result = self.do_move(
-                action, board=board, bookkeeping=False, true_gameplay=False
-            )
-            temp_reward = current_reward + self.add_temp_reward(fight_result)
-            new_val = self.min_val(board, temp_reward, alpha, beta, depth - 1)[0]
-            if val < new_val:
-                val = new_val
-                best_action = action
-            if val >= beta:
-                self.undo_last_move(board)
-                best_action = action
-                return val, best_action
-            alpha = max(alpha, val)
-            board = self.undo_last_move(board)
-        return val, best_action
-
-    def min_val(self, board, current_reward, alpha, beta, depth):
-        """
-        Step of the minimizing player in the minimax algorithm. See max_val for documentation.
-        """
-        # this is what the opponent will think, the min-player
-
-        # get my possible actions, then shuffle them to ensure randomness when no action
-        # stands out as the best
-        my_doable_actions = utils.get_poss_moves(board, self.other_team)
-        np.random.shuffle(my_doable_actions)
-
-        # check for terminal-state scenario or maximum depth
-        done, won = self.goal_test(my_doable_actions, board, max_val=False)
-        if done or depth == 0:
-            return current_reward + self.get_terminal_reward(done, won, depth), None
-
-        val = float("inf")  # initial value set, so min comparison later possible
-        best_action = None
-        # iterate through all actions
-        for action in my_doable_actions:
-            board, fight_result = self.do_move(
-                action, board=board, bookkeeping=False, true_gameplay=False
-            )
-            temp_reward = current_reward - self.add_temp_reward(fight_result)
-            new_val = self.max_val(board, temp_reward, alpha, beta, depth - 1)[0]
-            if val > new_val:
-                val = new_val
-                best_action = action
-            if val <= alpha:
-                self.undo_last_move(board)
-                return val, best_action
-            beta = min(beta, val)
-            board = self.undo_last_move(board)
-        return val, best_action
-
-    def add_temp_reward(self, fight_result):
-        """
-        reward the fight given the outcome of it.
-        :param fight_result: integer category of the fight outcome
-        :return: reward, float
-        """
-        # depending on the fight we want to update the current paths value
-        temp_reward = 0
-        if fight_result is not None:
-            if fight_result == 1:  # attacker won
-                temp_reward = self.kill_reward
-            elif fight_result == 2:  # attacker won, every piece was known before
-                temp_reward = int(self.certainty_multiplier * self.kill_reward)
-            elif fight_result == 0:  # neutral outcome
-                temp_reward = self.neutral_fight  # both pieces die
-            elif fight_result == -1:  # attacker lost
-                temp_reward = -self.kill_reward
-            elif fight_result == -2:  # attacker lost, every piece was known before
-                temp_reward = -int(self.certainty_multiplier * self.kill_reward)
-        return temp_reward
-
-    def goal_test(self, actions_possible, board, max_val):
-        """
-        check the board for whether a flag has been captured already and return the winning game rewards,
-        if not check whether there are no actions possible anymore, return TRUE then, or FALSE.
-        :param actions_possible: list of moves
-        :param board: numpy array (5, 5)
-        :param max_val: boolean, decider whether this is a goal test for maximizing player
-        :return: boolean: reached terminal state, boolean: own team (True) or other team won (False)
-        """
-        flag_alive = [False, False]
-        for pos, piece in np.ndenumerate(board):
-            if piece is not None and int == 0:
-                flag_alive[piece.team] = True
-        if not flag_alive[self.other_team]:
-            return True, True
-        # if not flag_alive[self.team]:
-        #     return True, False
-        if not actions_possible:
-            # print('cannot move anymore')
-            if (
-                max_val
-            ):  # the minmax agent is the one doing max_val, so if he cant move -> loss for him
-                won = False
-            else:
-                won = True
-            return True, won
-        else:
-            return False, None
+    def material(self, cells):
+        """Material balance from the point of view of self.color"""
+        score = 0
+        for c in cells:
+            if c:
+                score += value_of(c) if c >> 4 == self.own else -value_of(c)
+        return score
 
-    def get_terminal_reward(self, done, won, depth):
-        """
-        Reward for ending the game on a certain depth. If ended because of flag capture, then
-        reward with a depth discounted winGameReward. If ended because of depth limitation,
-        return 0
-        :param done: boolean, indicate whether the game ended
-        :param won: boolean, indicate whether the game was won or lost
-        :param depth: the depth at which the game ended
-        :return: game end reward, float
-        """
-        if not done:
-            return 0
+    def search(self, game, depth, alpha, beta, ply, material):
+        """Negamax alpha-beta search of game.board, material is the material balance for the
+        side to move. Returns the score for the side to move, fills in self.pv[ply] and sets
+        root_move at ply 0. Raises SearchAborted once the budget is used up."""
+        self.nodes += 1
+        if self.node_limit is not None and self.nodes > self.node_limit:
+            raise SearchAborted()
+        if self.deadline is not None and self.nodes & 1023 == 0 and time.perf_counter() >= self.deadline:
+            raise SearchAborted()
+        pv = self.pv
+        pv[ply] = []
+        if depth == 0:
+            return material
+        board = game.board
+        tt = self.tt
+        tt_move = None
+        if tt is not None:
+            entry = tt.probe(board.key)
+            if entry is not None:
+                tt_depth, bound, score, move = entry
+                if move >= 0:
+                    tt_move = (move // 1000, move // 100 % 10, move // 10 % 10, move % 10)
+                if tt_depth >= depth and ply > 0:
+                    # Win and loss scores are stored relative to the stored position
+                    if score >= WIN - MAX_PLY:
+                        score -= ply
+                    elif score <= -WIN + MAX_PLY:
+                        score += ply
+                    if bound == EXACT or (bound == LOWER and score >= beta) or (bound == UPPER and score <= alpha):
+                        return score
+        moves = game.legal_moves(pieces.COLORS[board.turn])
+        if not moves:
+            return -WIN + ply
+        if ply == 0:
+            self.rng.shuffle(moves)
+        pv_move = None
+        if self.follow_pv and ply < len(self.previous_pv):
+            pv_move = self.previous_pv[ply]
+        original_alpha = alpha
+        # With exact_root every root move is searched with the full window, not just the best
+        exact = ply == 0 and self.exact_root
+        best = -WIN - 1
+        best_move = None
+        for move in self.order_moves(board.cells, moves, ply, pv_move, tt_move):
+            # Only the first move of the previous principal variation continues along it
+            self.follow_pv = pv_move is not None and move == pv_move
+            source = move[0] * 10 + move[1]
+            target = move[2] * 10 + move[3]
+            quiet = not board.cells[target]
+            score = self.child_score(game, move, depth, original_alpha if exact else alpha, beta, ply, material)
+            if ply == 0:
+                self.root_scores[move] = score
+            if score > best:
+                best = score
+                best_move = move
+                pv[ply] = [move] + pv[ply + 1]
+                if ply == 0:
+                    self.root_move = move
+            if best > alpha:
+                alpha = best
+            if alpha >= beta:
+                if quiet:
+                    killers = self.killers[ply]
+                    if killers[0] != move:
+                        killers[1] = killers[0]
+                        killers[0] = move
+                    self.history[source * 100 + target] += depth * depth
+                break
+        if tt is not None:
+            bound = UPPER if best <= original_alpha else LOWER if best >= beta else EXACT
+            stored = best + ply if best >= WIN - MAX_PLY else best - ply if best <= -WIN + MAX_PLY else best
+            move = -1
+            if bound != UPPER:
+                move = best_move[0] * 1000 + best_move[1] * 100 + best_move[2] * 10 + best_move[3]
+            tt.store(board.key, depth, bound, stored, move)
+        return best
+
+    def child_score(self, game, move, depth, alpha, beta, ply, material):
+        """Plays move, searches the position it leads to with the window (alpha, beta) of the
+        side to move and takes the move back. Returns the score of move for the side to move."""
+        source, target, attacker, defender, victor = game.push_move(move)
+        if defender and (defender & pieces.TYPE_MASK) == pieces.FLAG + 1:
+            score = WIN - ply - 1
+            self.pv[ply + 1] = []
         else:
-            if won:
-                terminal_reward = self.winGameReward
+            gain = (value_of(defender) if victor != defender else 0) - (value_of(attacker) if victor != attacker else 0)
+            score = -self.search(game, depth - 1, -beta, -alpha, ply + 1, -(material + gain))
+        game.pop_move()
+        return score
+
+    def capture_gain(self, cells, source, target):
+        """Material the side to move gains by the capture from source to target"""
+        return capture_gain(cells[source], cells[target])
+
+    def order_moves(self, cells, moves, ply, pv_move=None, tt_move=None):
+        """The principal variation move first, then the transposition table's best move, then
+        captures that do not lose material (best gain first), then the killer moves, then quiet
+        moves by history score, then losing captures"""
+        killers = self.killers[ply]
+        history = self.history
+        keyed = []
+        for move in moves:
+            source = move[0] * 10 + move[1]
+            target = move[2] * 10 + move[3]
+            defender = cells[target]
+            if move == pv_move:
+                key = (5, 0)
+            elif move == tt_move:
+                key = (4, 0)
+            elif defender:
+                gain = self.capture_gain(cells, source, target)
+                key = (3, gain) if gain >= 0 else (0, gain)
+            elif move == killers[0] or move == killers[1]:
+                key = (2, 0)
             else:
-                terminal_reward = -self.winGameReward
-            return (
-                terminal_reward
-                * (depth + 1)
-                / (self.max_depth + 1)
-                * (terminal_reward / self.kill_reward)
-            )
-
-    def update_prob_by_fight(self, enemy_piece):
-        """
-        update the information about the given piece, after a fight occured
-        :param enemy_piece: object of class Piece
-        :return: change is in-place, no value specified
-        """
-        enemy_piece.potential_types = [2]
+                key = (1, history[source * 100 + target])
+            keyed.append((key, move))
+        keyed.sort(key=lambda k: k[0], reverse=True)
+        return [move for key, move in keyed]
 
-    def update_prob_by_move(self, move, moving_piece):
+    def remaining_enemy_types(self, board, spy=None):
+        """Returns {piece type: count} of the enemy pieces that are still hidden. Taken from spy
+        if given, otherwise the full setup minus the enemy pieces already known on the board."""
+        if spy is not None:
+            return {pieces.RANK_OF[name]: n for name, n in spy.remaining_enemy_pieces.items() if n > 0}
+        remaining = {pieces.RANK_OF[name]: n for name, n in setup_generator.STARTING_QUANTITIES.items()}
+        for c in board.cells:
+            if c and c >> 4 != self.own and pieces.rank_of(c) != pieces.UNKNOWN:
+                remaining[pieces.rank_of(c)] -= 1
+        return remaining
+
+    def draw_consistent_enemy_setup(self, board, spy=None):
         """
-        update the information about the given piece, after it did the given move
-        :param move: tuple of positions tuples
-        :param moving_piece: object of class Piece
-        :return: change is in-place, no value specified
+        Returns a clone of board with every hidden enemy piece replaced by a piece type drawn
+        from the enemy's remaining pieces, consistent with what spy knows about every square
+        (any type left is possible without a spy). See determinisation.py.
         """
-        move_dist = spatial.distance.cityblock(move[0], move[1])
-        if move_dist > 1:
-            moving_piece.hidden = False
-            moving_piece.potential_types = [2]  # piece is 2
+        return self.draw_consistent_enemy_setups(board, spy, 1)[0]
+
+    def draw_consistent_enemy_setups(self, board, spy=None, n=1):
+        """Same as draw_consistent_enemy_setup for n independent draws"""
+        enemy = 1 - self.own
+        hidden_code = pieces.code(enemy, pieces.UNKNOWN)
+        hidden = [i for i, c in enumerate(board.cells) if c == hidden_code]
+        if not hidden:
+            return [board.clone() for _ in range(n)]
+        size = board.size
+        if spy is None:
+            allowed = [range(pieces.NUM_TYPES)] * len(hidden)
         else:
-            immobile_enemy_types = [
-                idx
-                for idx, type in enumerate(moving_piece.potential_types)
-                if type in [0, 11]
-            ]
-            moving_piece.potential_types = np.delete(
-                moving_piece.potential_types, immobile_enemy_types
-            )
-
-    def draw_consistent_enemy_setup(self, board):
-        """
-        Draw a setup of the enemies pieces on the board provided that aligns with the current status of
-        information about said pieces, then place them on the board. This is done via iterative random sampling,
-        until a consistent draw occurs. This draw may or may not represent the overall true distribution of the pieces.
-        :param board: numpy array (5, 5)
-        :return: board with the assigned enemy pieces in it.
-        """
-        # get information about enemy pieces (how many, which alive, which types, and indices in assign. array)
-        enemy_pieces = copy.deepcopy(self.ordered_opp_pieces)
-        enemy_pieces_alive = [piece for piece in enemy_pieces if not piece.dead]
-        tokens_alive = [piece.token for piece in enemy_pieces_alive]
-
-        # do the following as long as the drawn assignment is not consistent with the current knowledge about them
-        consistent = False
-        sample = None
-        while not consistent:
-            # choose as many pieces randomly as there are enemy pieces alive
-            sample = np.random.choice(tokens_alive, len(tokens_alive), replace=False)
-            # while-loop break condition
-            consistent = True
-            for idx, piece in enumerate(enemy_pieces_alive):
-                # if the drawn type doesn't fit the potential types of the current piece, then redraw
-                if sample[idx] not in piece.potential_types:
-                    consistent = False
-                    break
-        # place this draw now on the board by assigning the types and changing critical attributes
-        for idx, piece in enumerate(enemy_pieces_alive):
-            # add attribute of the piece being guessed (only happens in non-real gameplay aka planning)
-            piece.guessed = not piece.hidden
-            int = sample[idx]
-            if int in [0, 11]:
-                piece.can_move = False
-                piece.move_range = 0
-            elif int == 2:
-                piece.can_move = True
-                piece.move_range = float("inf")
-            else:
-                piece.can_move = True
-                piece.move_range = 1
-            piece.hidden = False
-            board[piece.position] = piece
-        return board
+            allowed = [[pieces.RANK_OF[name] for name, p in spy.at(i // size, i % size).items() if p > 0]
+                       for i in hidden]
+        sampler = ConstraintSampler(allowed, self.remaining_enemy_types(board, spy))
+        boards = []
+        for types in sampler.samples(n, self.rng):
+            clone = board.clone()
+            cells = clone.cells
+            for i, t in zip(hidden, types):
+                cells[i] = pieces.code(enemy, t)
+            clone.rehash()
+            boards.append(clone)
+        return boards
 
-    def undo_last_move(self, board):
-        """
-        Undo the last move in the memory. Return the updated board.
-        :param board: numpy array (5, 5)
-        :return: board
-        """
-        last_move = self.last_N_moves.pop_last()
-        if last_move is None:
-            raise ValueError("No last move to undo detected!")
-        before_piece = self.pieces_last_N_Moves_beforePos.pop_last()
-        board[last_move[0]] = before_piece
-        # the piece at the 'before' spatial was the one that moved, so needs its
-        # last entry in the move history deleted
-        before_piece.position = last_move[0]
-        board[last_move[1]] = self.pieces_last_N_Moves_afterPos.pop_last()
-        return board
 
+class Expectimax(MinMax):
+    def __init__(self, color, depth=None, rng=random, time_budget=None, node_budget=None):
+        """Search playing color that leaves the enemy's hidden pieces hidden. A fight with a
+        hidden piece is a chance node: every outcome is searched and weighted by its probability
+        under the piece's Spy distribution. Search options as for MinMax. There is no
+        transposition table, the board hash does not cover the distributions."""
+        super().__init__(color, depth, rng, time_budget, node_budget, tt_size_mb=0)
+        # versions[v] is a distribution over piece types and version_values[v] its expected
+        # material value. version_at[square] is the version of the hidden piece on square, -1 if
+        # there is none. Fights and moves narrow distributions down into new versions.
+        self.versions = []
+        self.version_values = []
+        self.version_at = []
+        self.conditioned = {}
+        # Outcome probabilities of fights with a hidden piece, per (square, version)
+        self.chance_cache = {}
+        self.chance_hits = 0
+        self.chance_misses = 0
+
+    def decide_move(self, board, spy=None):
+        move = super().decide_move(board, spy)
+        self.stats[-1].update(chance_hits=self.chance_hits, chance_misses=self.chance_misses)
+        return move
+
+    def position_to_search(self, board, spy=None):
+        """Returns a clone of board, hidden pieces included, and sets up their distributions:
+        spy.at for every hidden square, or the enemy's remaining pieces without a spy. A square
+        the spy gives no weight falls back to the remaining pieces, and to every type if none
+        are left either."""
+        self.versions = []
+        self.version_values = []
+        self.conditioned = {}
+        self.chance_cache = {}
+        self.version_at = [-1] * len(board.cells)
+        hidden_code = pieces.code(1 - self.own, pieces.UNKNOWN)
+        counts = self.remaining_enemy_types(board, spy)
+        prior = None
+        size = board.size
+        for i, c in enumerate(board.cells):
+            if c != hidden_code:
+                continue
+            version = None
+            if spy is not None:
+                p = np.zeros(pieces.NUM_TYPES)
+                for name, probability in spy.at(i // size, i % size).items():
+                    p[pieces.RANK_OF[name]] = probability
+                version = self.add_version(p)
+            if version is None:
+                if prior is None:
+                    prior = self.add_version(np.array([max(0, counts.get(t, 0)) for t in range(pieces.NUM_TYPES)],
+                                                      dtype=np.float64))
+                    if prior is None:
+                        prior = self.add_version(np.ones(pieces.NUM_TYPES))
+                version = prior
+            self.version_at[i] = version
+        return board.clone()
+
+    def add_version(self, p):
+        """Adds the distribution p (weights over piece types) and returns its version, or None if
+        p has no weight at all"""
+        total = p.sum()
+        if total <= 0:
+            return None
+        p = p / total
+        self.versions.append(p)
+        self.version_values.append(float(p @ VALUE_VECTOR))
+        return len(self.versions) - 1
+
+    def condition(self, version, key, mask):
+        """Returns the version of version's distribution restricted to the types in mask, key
+        names the restriction. None if no type is left."""
+        result = self.conditioned.get((version, key), -1)
+        if result == -1:
+            result = self.conditioned[(version, key)] = self.add_version(self.versions[version] * mask)
+        return result
+
+    def movable(self, version):
+        """Version for a hidden piece that has moved, so is no bomb or flag"""
+        return self.condition(version, "movable", IMMOBILE_MASK)
+
+    def chance_table(self, square, version):
+        """Returns (defending, attacking) for the hidden piece of the given version on square:
+        defending[k][t] is the probability of OUTCOMES[k] when a piece of type t attacks it,
+        attacking[k][t] when it attacks a piece of type t. Every outcome for every type is worked
+        out in one batched product with the battle table, and cached per (square, version)."""
+        key = (square, version)
+        table = self.chance_cache.get(key)
+        if table is None:
+            self.chance_misses += 1
+            p = self.versions[version]
+            table = self.chance_cache[key] = ((OUTCOME_MASKS @ p).tolist(), (p @ OUTCOME_MASKS).tolist())
+        else:
+            self.chance_hits += 1
+        return table
+
+    def material(self, cells):
+        """Material balance from the point of view of self.color, hidden pieces count their
+        expected value"""
+        score = 0
+        for i, c in enumerate(cells):
+            if c:
+                if c >> 4 == self.own:
+                    score += value_of(c)
+                elif (c & pieces.TYPE_MASK) - 1 == pieces.UNKNOWN:
+                    score -= self.version_values[self.version_at[i]]
+                else:
+                    score -= value_of(c)
+        return score
+
+    def capture_gain(self, cells, source, target):
+        """Expected material the side to move gains by the capture from source to target"""
+        attacker, defender = cells[source], cells[target]
+        if (defender & pieces.TYPE_MASK) - 1 == pieces.UNKNOWN:
+            version = self.version_at[target]
+            defending = self.chance_table(target, version)[0]
+            t = (attacker & pieces.TYPE_MASK) - 1
+            return defending[0][t] * self.version_values[version] - defending[1][t] * value_of(attacker)
+        if (attacker & pieces.TYPE_MASK) - 1 == pieces.UNKNOWN:
+            version = self.movable(self.version_at[source])
+            if version is None:
+                return -WIN
+            attacking = self.chance_table(source, version)[1]
+            t = (defender & pieces.TYPE_MASK) - 1
+            return attacking[0][t] * value_of(defender) - attacking[1][t] * self.version_values[version]
+        return capture_gain(attacker, defender)
+
+    def child_score(self, game, move, depth, alpha, beta, ply, material):
+        cells = game.board.cells
+        source = move[0] * 10 + move[1]
+        target = move[2] * 10 + move[3]
+        attacker, defender = cells[source], cells[target]
+        hidden_attacker = (attacker & pieces.TYPE_MASK) - 1 == pieces.UNKNOWN
+        hidden_defender = defender and (defender & pieces.TYPE_MASK) - 1 == pieces.UNKNOWN
+        if defender and (hidden_attacker or hidden_defender):
+            self.pv[ply + 1] = []
+            return self.chance(game, source, target, depth, ply, material)
+        if not hidden_attacker:
+            return super().child_score(game, move, depth, alpha, beta, ply, material)
+        # A hidden piece moving to an empty square shows it is no bomb or flag
+        version_at = self.version_at
+        version = version_at[source]
+        moved = self.movable(version)
+        if moved is None:
+            return -WIN - 1
+        gain = self.version_values[moved] - self.version_values[version]
+        game.push_move(move)
+        version_at[source], version_at[target] = -1, moved
+        try:
+            score = -self.search(game, depth - 1, -beta, -alpha, ply + 1, -(material + gain))
+        finally:
+            version_at[source], version_at[target] = version, -1
+            game.pop_move()
+        return score
+
+    def chance(self, game, source, target, depth, ply, material):
+        """Expected score, for the side to move, of the fight from source to target between a
+        known and a hidden piece. Every outcome is searched with the full window."""
+        board = game.board
+        cells = board.cells
+        version_at = self.version_at
+        attacker, defender = cells[source], cells[target]
+        hidden_attacks = (attacker & pieces.TYPE_MASK) - 1 == pieces.UNKNOWN
+        if hidden_attacks:
+            version = self.movable(version_at[source])
+            if version is None:
+                return -WIN - 1
+            known = (defender & pieces.TYPE_MASK) - 1
+            probabilities = self.chance_table(source, version)[1]
+            before_attacker, before_defender = self.version_values[version_at[source]], value_of(defender)
+            flag = 0.0
+        else:
+            version = version_at[target]
+            known = (attacker & pieces.TYPE_MASK) - 1
+            probabilities = self.chance_table(target, version)[0]
+            before_attacker, before_defender = value_of(attacker), self.version_values[version]
+            # Any piece takes the flag, which ends the game
+            flag = float(self.versions[version][pieces.FLAG])
+        value = flag * (WIN - ply - 1)
+        for k, outcome in enumerate(OUTCOMES):
+            p = probabilities[k][known] - (flag if outcome == utils.ATTACKER_WINS else 0.0)
+            if p <= 1e-12:
+                continue
+            attacker_survives = outcome == utils.ATTACKER_WINS
+            defender_survives = outcome == utils.DEFENDER_WINS
+            survivor_version = -1
+            if hidden_attacks and attacker_survives:
+                survivor_version = self.condition(version, ("attacks", known, outcome), OUTCOME_MASKS[k][:, known])
+            elif not hidden_attacks and defender_survives:
+                mask = OUTCOME_MASKS[k][known].copy()
+                mask[pieces.FLAG] = 0.0
+                survivor_version = self.condition(version, ("defends", known, outcome), mask)
+            after_attacker = 0.0
+            if attacker_survives:
+                after_attacker = self.version_values[survivor_version] if hidden_attacks else before_attacker
+            after_defender = 0.0
+            if defender_survives:
+                after_defender = before_defender if hidden_attacks else self.version_values[survivor_version]
+            gain = (after_attacker - before_attacker) - (after_defender - before_defender)
+            old_source, old_target = version_at[source], version_at[target]
+            board.put(target, attacker if attacker_survives else defender if defender_survives else pieces.EMPTY)
+            board.put(source, pieces.EMPTY)
+            board.pass_turn()
+            version_at[source] = -1
+            version_at[target] = survivor_version
+            try:
+                score = -self.search(game, depth - 1, -WIN - 1, WIN + 1, ply + 1, -(material + gain))
+            finally:
+                # Also taken back when the budget runs out, version_at outlives the search
+                board.pass_turn()
+                board.put(source, attacker)
+                board.put(target, defender)
+                version_at[source], version_at[target] = old_source, old_target
+            value += p * score
+        return value
@@ -0,0 +1,386 @@
+import contextlib
+import io
+import itertools
+import random
+import time
+import unittest
+from collections import Counter
+from unittest import mock
+import pieces
+import setup_generator
+import stratego
+from heuristic import MinMax, Expectimax, WIN, MAX_PLY
+import determinisation
+from determinisation import ConstraintSampler, fits
+from transposition import TranspositionTable, EXACT, LOWER, UPPER
+
+
+def negamax(engine, game, depth, ply=0):
+    """Plain negamax without pruning, the reference for the alpha-beta search"""
+    board = game.board
+    if depth == 0:
+        material = engine.material(board.cells)
+        return material if board.turn == engine.own else -material
+    moves = game.legal_moves(pieces.COLORS[board.turn])
+    if not moves:
+        return -WIN + ply
+    best = -WIN - 1
+    for move in moves:
+        source, target, attacker, defender, victor = game.push_move(move)
+        if defender and pieces.rank_of(defender) == pieces.FLAG:
+            score = WIN - ply - 1
+        else:
+            score = -negamax(engine, game, depth - 1, ply + 1)
+        game.pop_move()
+        best = max(best, score)
+    return best
+
+
+def endgame():
+    """A small position with a few pieces on each side, blue to move"""
+    game = stratego.Game()
+    for piece, row, column in [("blue_flag", 0, 0), ("blue_five", 3, 1), ("blue_nine", 1, 5),
+                               ("blue_three", 2, 8), ("red_flag", 9, 9), ("red_four", 6, 1),
+                               ("red_bomb", 8, 9), ("red_nine", 7, 5), ("red_six", 5, 8)]:
+        game.set_at(piece, row, column)
+    return game
+
+
+class TestMinMax(unittest.TestCase):
+
+    def test_alpha_beta_matches_minimax(self):
+        for depth in [1, 2, 3]:
+            game = endgame()
+            engine = MinMax("blue", depth=depth, rng=random.Random(depth), tt_size_mb=0)
+            move = engine.decide_move(game.board)
+            self.assertEqual(negamax(engine, game, depth), engine.stats[-1]["score"])
+            game.push_move(move)
+            self.assertEqual(engine.stats[-1]["score"], -negamax(engine, game, depth - 1, 1))
+
+    def test_captures_the_flag(self):
+        game = endgame()
+        game.set_at("red_flag", 4, 5)
+        game.remove_at(9, 9)
+        engine = MinMax("blue", depth=3)
+        self.assertEqual((1, 5, 4, 5), engine.decide_move(game.board))
+        self.assertEqual(WIN - 1, engine.stats[-1]["score"])
+
+    def test_budgets_return_the_last_completed_iteration(self):
+        game = endgame()
+        engine = MinMax("blue", node_budget=3000, tt_size_mb=0)
+        engine.decide_move(game.board)
+        stats = engine.stats[-1]
+        self.assertLessEqual(stats["nodes"], 3001)
+        self.assertGreaterEqual(stats["depth"], 2)
+        self.assertEqual(stats["move"], stats["pv"][0])
+        self.assertEqual(stats["depth"], len(stats["pv"]))
+        fixed = MinMax("blue", depth=stats["depth"], tt_size_mb=0)
+        fixed.decide_move(game.board)
+        self.assertEqual(fixed.stats[-1]["score"], stats["score"])
+
+        engine = MinMax("blue", time_budget=0.1)
+        engine.decide_move(stratego.random_board())
+        self.assertLess(engine.stats[-1]["seconds"], 0.2)
+
+    def test_transposition_table_saves_nodes(self):
+        game = endgame()
+        nodes = []
+        for tt_size_mb in [0, 1]:
+            engine = MinMax("blue", depth=5, rng=random.Random(1), tt_size_mb=tt_size_mb)
+            self.assertIn(engine.decide_move(game.board), game.legal_moves("blue"))
+            nodes.append(engine.stats[-1]["nodes"])
+        self.assertLess(nodes[1], nodes[0])
+        self.assertGreater(engine.tt.hits, 0)
+        self.assertEqual(engine.tt.stores, engine.stats[-1]["tt_stores"])
+
+    def test_exact_root_scores(self):
+        game = endgame()
+        engine = MinMax("blue", tt_size_mb=0)
+        result = engine.search_position(game.board, 3, exact_root=True)
+        self.assertEqual(set(game.legal_moves("blue")), set(result["root_scores"]))
+        for move, score in result["root_scores"].items():
+            game.push_move(move)
+            self.assertEqual(-negamax(engine, game, 2, 1), score, f"{move}")
+            game.pop_move()
+        self.assertEqual(max(result["root_scores"].values()), result["score"])
+
+    def test_search_position_leaves_the_board_alone(self):
+        random.seed(9)
+        board = stratego.random_board()
+        board.pass_turn()
+        cells, key = board.cells[:], board.hash()
+        for node_budget in [None, 50]:
+            engine = MinMax("blue", node_budget=node_budget, tt_size_mb=0)
+            engine.search_position(board, 3 if node_budget is None else MAX_PLY - 1, node_budget=node_budget)
+            self.assertEqual((cells, key, pieces.RED), (board.cells, board.hash(), board.turn))
+
+    def test_determinisations_share_the_budget(self):
+        random.seed(8)
+        game = stratego.Game()
+        game.board = stratego.random_board()
+        seen = game.board_as_seen_by("blue")
+        for workers in [None, 2]:
+            with MinMax("blue", node_budget=3000, determinisations=3, workers=workers, rng=random.Random(4)) as engine:
+                self.assertIn(engine.decide_move(seen), game.legal_moves("blue"))
+            self.assertIsNone(engine.pool)
+            row = engine.stats[-1]
+            self.assertEqual(3, row["determinisations"])
+            self.assertLessEqual(row["nodes"], 3003)
+            self.assertGreaterEqual(row["votes"], 1)
+
+    def test_aggregation(self):
+        a, b = (3, 0, 4, 0), (3, 1, 4, 1)
+        results = [{"move": a, "depth": 2, "pv": [a], "nodes": 5, "root_scores": {a: 10, b: 9}},
+                   {"move": a, "depth": 3, "pv": [a], "nodes": 5, "root_scores": {a: 10, b: 9}},
+                   {"move": b, "depth": 2, "pv": [b], "nodes": 5, "root_scores": {a: -50, b: 20}}]
+        row = MinMax("blue", aggregation="vote", tt_size_mb=0).aggregate(results)
+        self.assertEqual((a, 2, 2, 15), (row["move"], row["votes"], row["depth"], row["nodes"]))
+        row = MinMax("blue", aggregation="mean", tt_size_mb=0).aggregate(results)
+        self.assertEqual((b, 1), (row["move"], row["votes"]))
+        self.assertAlmostEqual(38 / 3, row["score"])
+
+    def test_select_move_plays_legal_moves(self):
+        for engine_type in ["minmax", "expectimax"]:
+            random.seed(5)
+            game = stratego.Game()
+            game.engine_type = engine_type
+            game.time_budget = 0.1
+            game.board = stratego.random_board()
+            for _ in range(4):
+                player = pieces.COLORS[game.board.turn]
+                with contextlib.redirect_stdout(io.StringIO()):
+                    move = game.select_move(player, game.board_as_seen_by(player))
+                self.assertIn(move, game.legal_moves(player))
+                self.assertGreater(game.engines[player].stats[-1]["nodes"], 0)
+                game.make_move(move)
+
+    def test_select_move_uses_the_players_spy(self):
+        game = stratego.Game()
+        for piece, row, column in [("blue_flag", 0, 0), ("blue_five", 3, 0), ("blue_four", 0, 5),
+                                   ("red_flag", 9, 9), ("red_five", 9, 5), ("red_four", 4, 0)]:
+            game.set_at(piece, row, column)
+        game.engine_type = "expectimax"
+        game.time_budget = 0.1
+        # Blue's five loses to the red four, which is then known, and the red five shows it can move
+        game.make_move((3, 0, 4, 0))
+        game.make_move((9, 5, 8, 5))
+        self.assertEqual({"four": 1.0}, game.spies["blue"].at(4, 0))
+        with contextlib.redirect_stdout(io.StringIO()):
+            move = game.select_move("blue", game.board_as_seen_by("blue"))
+        self.assertIn(move, game.legal_moves("blue"))
+        engine = game.engines["blue"]
+        self.assertEqual(1.0, engine.versions[engine.version_at[40]][pieces.RANK_OF["four"]])
+        self.assertEqual(1.0, engine.versions[engine.version_at[85]][pieces.RANK_OF["five"]])
+        self.assertEqual(1.0, engine.versions[engine.version_at[99]][pieces.FLAG])
+
+    def test_select_move_budget(self):
+        random.seed(7)
+        game = stratego.Game()
+        game.board = stratego.random_board()
+        with contextlib.redirect_stdout(io.StringIO()):
+            game.select_move("blue", game.board_as_seen_by("blue"))
+        self.assertEqual(stratego.DEFAULT_TIME_BUDGET, game.engines["blue"].time_budget)
+        self.assertLess(game.engines["blue"].stats[-1]["seconds"], 2 * stratego.DEFAULT_TIME_BUDGET)
+        # A fixed depth has to be asked for
+        game = stratego.Game()
+        game.board = stratego.random_board()
+        game.time_budget = None
+        game.search_depth = 3
+        with contextlib.redirect_stdout(io.StringIO()):
+            game.select_move("blue", game.board_as_seen_by("blue"))
+        self.assertEqual(3, game.engines["blue"].stats[-1]["depth"])
+
+    def test_enemy_setup_is_drawn_from_remaining_pieces(self):
+        random.seed(2)
+        game = stratego.Game()
+        game.board = stratego.random_board()
+        seen = game.board_as_seen_by("blue")
+        drawn = MinMax("blue").draw_consistent_enemy_setup(seen)
+        self.assertEqual(seen.cells[:60], drawn.cells[:60])
+        self.assertEqual(sorted(game.board.cells[60:]), sorted(drawn.cells[60:]))
+        key = drawn.hash()
+        drawn.rehash()
+        self.assertEqual(key, drawn.hash())
+
+
+class TestTranspositionTable(unittest.TestCase):
+
+    def test_store_and_probe(self):
+        tt = TranspositionTable(1)
+        self.assertIsNone(tt.probe(12345))
+        tt.store(12345, 3, LOWER, -70, 4321)
+        self.assertEqual((3, LOWER, -70, 4321), tt.probe(12345))
+        tt.store(12345, 2, UPPER, -90)
+        self.assertEqual((3, LOWER, -70, 4321), tt.probe(12345), "Deeper result stays in the first slot")
+        self.assertEqual((1, 1, 2), (tt.misses, tt.stores - 1, tt.hits))
+
+    def test_replacement(self):
+        tt = TranspositionTable(1)
+        a, b, c = 7, 7 + tt.buckets, 7 + 2 * tt.buckets
+        tt.store(a, 5, EXACT, 10)
+        tt.store(b, 2, EXACT, 20)
+        tt.store(c, 1, EXACT, 30)
+        self.assertEqual(5, tt.probe(a)[0], "Depth-preferred slot keeps the deepest entry")
+        self.assertIsNone(tt.probe(b), "Always-replace slot takes the newest entry")
+        self.assertEqual(1, tt.probe(c)[0])
+        self.assertEqual(1, tt.collisions)
+        tt.new_search()
+        tt.store(b, 2, EXACT, 20)
+        self.assertIsNone(tt.probe(a), "Entries of earlier searches give way")
+        self.assertEqual(2, tt.probe(b)[0])
+        self.assertEqual(2, len(tt))
+
+
+class KnownPiecesSpy:
+    """Stands in for a Spy that has narrowed down every hidden square to a few piece names"""
+
+    def __init__(self, state, remaining):
+        self.state = state
+        self.remaining_enemy_pieces = remaining
+
+    def at(self, row, column):
+        return self.state[(row, column)]
+
+
+class TestConstraintSampler(unittest.TestCase):
+
+    def test_draws_respect_constraints(self):
+        flag, bomb, scout, miner = pieces.FLAG, pieces.BOMB, pieces.SCOUT, pieces.MINER
+        allowed = [{flag, bomb}] * 3 + [{bomb, scout}] * 4 + [{scout, miner}] * 3 + [{miner}]
+        counts = {flag: 1, bomb: 4, scout: 3, miner: 3}
+        sampler = ConstraintSampler(allowed, counts)
+        seen = set()
+        for types in sampler.samples(500, random.Random(1)):
+            for t, a in zip(types, allowed):
+                self.assertIn(t, a)
+            for t, n in counts.items():
+                self.assertLessEqual(types.count(t), n)
+            seen.add(tuple(types))
+        self.assertGreater(len(seen), 10, "Every consistent setup should be reachable")
+
+    def test_many_distinct_masks(self):
+        rng = random.Random(4)
+        types = list(range(pieces.NUM_TYPES))
+        allowed = [set(rng.sample(types, rng.randint(2, 5))) for _ in range(40)]
+        counts = Counter(rng.choice(sorted(a)) for a in allowed)
+        self.assertGreater(len({frozenset(a) for a in allowed}), 30)
+        start = time.perf_counter()
+        draws = ConstraintSampler(allowed, counts).samples(10, rng)
+        self.assertLess(time.perf_counter() - start, 2)
+        for draw in draws:
+            self.assertTrue(all(t in a for t, a in zip(draw, allowed)))
+            self.assertTrue(all(draw.count(t) <= n for t, n in counts.items()))
+
+    def test_fits_matches_exhaustive_search(self):
+        rng = random.Random(8)
+        for _ in range(200):
+            masks = [rng.randrange(1, 16) for _ in range(rng.randint(1, 5))]
+            counts = [rng.randint(0, 2) for _ in range(4)] + [0] * (pieces.NUM_TYPES - 4)
+            possible = any(all(m >> t & 1 for m, t in zip(masks, choice))
+                           and all(choice.count(t) <= counts[t] for t in range(4))
+                           for choice in itertools.product(range(4), repeat=len(masks)))
+            for few_groups in [0, 5]:
+                with mock.patch.object(determinisation, "FEW_GROUPS", few_groups):
+                    self.assertEqual(possible, fits(Counter(masks), counts))
+
+    def test_fits_over_types_matches_fits_over_groups(self):
+        rng = random.Random(9)
+        sets = 1 << pieces.NUM_TYPES
+        for _ in range(100):
+            masks = [rng.randrange(sets) & rng.randrange(sets) | 1 << rng.randrange(pieces.NUM_TYPES)
+                     for _ in range(rng.randint(6, 12))]
+            counts = [rng.randint(0, 2) for _ in range(pieces.NUM_TYPES)]
+            results = []
+            for few_groups in [0, len(masks)]:
+                with mock.patch.object(determinisation, "FEW_GROUPS", few_groups):
+                    results.append(fits(Counter(masks), counts))
+            self.assertEqual(results[0], results[1])
+
+    def test_inconsistent_knowledge_raises(self):
+        with self.assertRaises(Exception):
+            ConstraintSampler([{pieces.FLAG}, {pieces.FLAG}], {pieces.FLAG: 1})
+        with self.assertRaises(Exception):
+            ConstraintSampler([{pieces.FLAG, pieces.BOMB}] * 3, {pieces.FLAG: 1, pieces.BOMB: 1, pieces.SCOUT: 5})
+
+    def test_enemy_setups_follow_the_spy(self):
+        random.seed(6)
+        game = stratego.Game()
+        game.board = stratego.random_board()
+        seen = game.board_as_seen_by("blue")
+        # Every red piece is known to be its own type or a bomb, far too tight for rejection sampling
+        state = {}
+        for i in range(60, 100):
+            name = pieces.RANK_NAMES[pieces.rank_of(game.board.cells[i])]
+            state[(i // 10, i % 10)] = {name: 0.5, "bomb": 0.5}
+        remaining = dict(setup_generator.STARTING_QUANTITIES)
+        boards = MinMax("blue").draw_consistent_enemy_setups(seen, KnownPiecesSpy(state, remaining), 20)
+        self.assertEqual(20, len(boards))
+        for board in boards:
+            self.assertEqual(sorted(game.board.cells[60:]), sorted(board.cells[60:]))
+            for i in range(60, 100):
+                if board.cells[i] != game.board.cells[i]:
+                    self.assertIn(pieces.BOMB, [pieces.rank_of(board.cells[i]), pieces.rank_of(game.board.cells[i])])
+
+
+class TestExpectimax(unittest.TestCase):
+
+    def test_matches_minmax_without_hidden_pieces(self):
+        game = endgame()
+        for depth in [1, 2, 3]:
+            minmax = MinMax("blue", depth=depth, tt_size_mb=0)
+            expectimax = Expectimax("blue", depth=depth)
+            minmax.decide_move(game.board)
+            expectimax.decide_move(game.board)
+            self.assertEqual(minmax.stats[-1]["score"], expectimax.stats[-1]["score"])
+
+    def test_chance_node_weights_outcomes_by_the_spy(self):
+        game = stratego.Game()
+        game.set_at("blue_one", 5, 0)
+        game.set_at("blue_eight", 6, 1)
+        game.set_at("red_?", 6, 0)
+        spy = KnownPiecesSpy({(6, 0): {"flag": 0.5, "bomb": 0.5}}, {"flag": 1, "bomb": 1})
+        engine = Expectimax("blue", depth=1)
+        # The miner takes the flag or defuses the bomb, the marshal would die on the bomb
+        self.assertEqual((6, 1, 6, 0), engine.decide_move(game.board, spy))
+        self.assertAlmostEqual(0.5 * (WIN - 1) + 0.5 * (100 + 25), engine.stats[-1]["score"])
+        self.assertGreater(engine.stats[-1]["chance_hits"], 0)
+        self.assertEqual(1, engine.stats[-1]["chance_misses"], "One table for the only hidden piece")
+
+    def test_spy_without_weight_falls_back_to_remaining_pieces(self):
+        game = stratego.Game()
+        game.set_at("blue_one", 5, 0)
+        game.set_at("red_?", 6, 0)
+        game.set_at("red_?", 9, 9)
+        state = {(6, 0): {"flag": 0.0, "bomb": 0.0}, (9, 9): {"flag": 1.0}}
+        for remaining in [{"flag": 1, "bomb": 1}, {"flag": 0, "bomb": 0}]:
+            engine = Expectimax("blue", depth=2)
+            self.assertIn(engine.decide_move(game.board, KnownPiecesSpy(state, remaining)),
+                          game.legal_moves("blue"))
+            self.assertNotIn(-1, [engine.version_at[60], engine.version_at[99]])
+            self.assertAlmostEqual(1.0, engine.versions[engine.version_at[60]].sum())
+
+    def test_aborted_search_restores_the_distributions(self):
+        random.seed(13)
+        game = stratego.Game()
+        game.board = stratego.random_board()
+        seen = game.board_as_seen_by("blue")
+        engine = Expectimax("blue", node_budget=300)
+        engine.decide_move(seen)
+        version_at = engine.version_at[:]
+        engine.position_to_search(seen)
+        self.assertEqual(engine.version_at, version_at)
+
+    def test_plays_from_the_players_view(self):
+        random.seed(12)
+        game = stratego.Game()
+        game.board = stratego.random_board()
+        for _ in range(20):
+            game.push_move(random.choice(game.legal_moves(pieces.COLORS[game.board.turn])))
+        player = pieces.COLORS[game.board.turn]
+        engine = Expectimax(player, node_budget=5000)
+        self.assertIn(engine.decide_move(game.board_as_seen_by(player)), game.legal_moves(player))
+        self.assertGreaterEqual(engine.stats[-1]["depth"], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
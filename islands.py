@@ -0,0 +1,121 @@
+"""Island model for the setup genetic algorithm.
+
+K islands evolve their own population in separate processes. Every migration_interval
+generations each island sends copies of its fittest layouts to the next island of a ring
+and replaces its own least fit layouts with the ones it receives. Layouts travel through
+pipes as int8 arrays of piece types. When every island is done, the populations are merged
+into a single pool of distinct layouts ranked by fitness.
+
+    python islands.py --islands 4 --generations 2000
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import threading
+from multiprocessing.connection import wait
+
+from GeneticAlgorithm import genetic_algoritgm, decode_population, layout_key
+
+
+def island(seed, generations, migration_interval, migrants, inbox, outbox, results, ga_options):
+    """Process entry point for a single island"""
+    random.seed(seed)
+    ga = genetic_algoritgm(generation=generations, **ga_options)
+    ga.createPopulation()
+    for generation in range(1, generations + 1):
+        ga.evolve_generation()
+        if migration_interval and generation % migration_interval == 0 and generation < generations:
+            # Send from a helper thread: with large batches every island of the ring could
+            # otherwise block in send, each waiting for its neighbour to receive
+            sender = threading.Thread(target=outbox.send, args=(ga.emigrants(migrants),))
+            sender.start()
+            ga.immigrate(inbox.recv())
+            sender.join()
+    results.send((ga.emigrants(len(ga.population)), sorted(ga.population_scores(), reverse=True)))
+
+
+def run_islands(islands, generations, migration_interval=50, migrants=2, seed=None, **ga_options):
+    """Evolve islands populations in parallel and return the merged pool of distinct
+    (fitness, layout) pairs, best first. ga_options are passed on to genetic_algoritgm
+    (populationSize, mutationRate, crossoverRate, vectorised, selection, ...)."""
+    if seed is None:
+        seed = random.getrandbits(32)
+    ring = [multiprocessing.Pipe(duplex=False) for _ in range(islands)]
+    results = [multiprocessing.Pipe(duplex=False) for _ in range(islands)]
+    processes = []
+    try:
+        for i in range(islands):
+            inbox = ring[i][0]
+            outbox = ring[(i + 1) % islands][1]
+            p = multiprocessing.Process(target=island,
+                                        args=(seed + i, generations, migration_interval, migrants,
+                                              inbox, outbox, results[i][1], ga_options))
+            p.start()
+            processes.append(p)
+        # The islands hold their own ends, the parent only reads the results
+        for receive, send in ring:
+            receive.close()
+            send.close()
+        for _, send in results:
+            send.close()
+        pool = collect(processes, [receive for receive, _ in results])
+    except BaseException:
+        for p in processes:
+            if p.is_alive():
+                p.terminate()
+        raise
+    finally:
+        for p in processes:
+            p.join()
+    return sorted(pool.values(), key=lambda s: s[0], reverse=True)
+
+
+def collect(processes, receivers):
+    """Merges the final populations sent through receivers, in island order, into {layout key:
+    (fitness, layout)}. Raises IslandFailed as soon as an island exits without sending its
+    population."""
+    populations = [None] * len(receivers)
+    pending = dict(enumerate(receivers))
+    while pending:
+        sentinels = {processes[i].sentinel: i for i in pending}
+        for ready in wait(list(pending.values()) + list(sentinels)):
+            if ready in sentinels:
+                i = sentinels[ready]
+                if i in pending and not pending[i].poll():
+                    processes[i].join()
+                    raise Exception(f"IslandFailed island {i} exited with code {processes[i].exitcode}")
+                continue
+            i = next(i for i, receive in pending.items() if receive is ready)
+            try:
+                populations[i] = ready.recv()
+            except EOFError:
+                raise Exception(f"IslandFailed island {i} closed its pipe without a population")
+            del pending[i]
+    pool = {}
+    for array, scores in populations:
+        for key, layout, score in zip((layout_key(a) for a in array), decode_population(array), scores):
+            pool.setdefault(key, (score, layout))
+    return pool
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Island model genetic algorithm for starting setups")
+    parser.add_argument("--islands", type=int, default=os.cpu_count())
+    parser.add_argument("--generations", type=int, default=10000)
+    parser.add_argument("--migration-interval", type=int, default=50)
+    parser.add_argument("--migrants", type=int, default=2)
+    parser.add_argument("--population", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    pool = run_islands(args.islands, args.generations, args.migration_interval, args.migrants, args.seed,
+                       populationSize=args.population, mutationRate=0.4, crossoverRate=0.6)
+    score, board = pool[0]
+    print(f"{len(pool)} distinct setups, best {score}")
+    for rows in board:
+        print(rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""Information set Monte Carlo tree search (single observer ISMCTS).
+
+One tree is grown over the moves of both players as seen by the searching player. Every
+iteration draws a new setup for the enemy's hidden pieces (see determinisation.py), walks down
+the tree with UCB1 among the moves that are legal in that setup, adds one node and finishes the
+game with a random playout. A child's exploration term counts the iterations it was available
+in rather than its parent's visits, since hidden pieces make some moves legal only in some
+setups.
+
+The tree is kept between turns: Game.make_move reports every move to the engines (observe) and
+the subtree under the moves actually played becomes the next root.
+"""
+import math
+import random
+import time
+
+import pieces
+import stratego
+from heuristic import MinMax, PIECE_VALUES
+
+# Setups drawn per call to the sampler
+SAMPLE_BATCH = 64
+
+
+class Node:
+    """Tree node, reached by move played by player. reward is summed from player's point of
+    view, available counts the iterations in which move was legal."""
+    __slots__ = ("move", "parent", "player", "children", "visits", "reward", "available")
+
+    def __init__(self, move, parent, player):
+        self.move = move
+        self.parent = parent
+        self.player = player
+        # Maps moves to child nodes, None until the node is expanded
+        self.children = None
+        self.visits = 0
+        self.reward = 0.0
+        self.available = 0
+
+
+class ISMCTS:
+    def __init__(self, color, iterations=1000, time_budget=None, exploration=0.7, playout_moves=40, rng=random):
+        """Tree search playing color ("blue" or "red"). Each move runs iterations iterations or
+        as many as fit in time_budget seconds, whichever comes first (None for no limit).
+        Playouts stop after playout_moves moves and are then scored by material."""
+        self.color = color
+        self.own = pieces.COLORS.index(color)
+        self.iterations = iterations
+        self.time_budget = time_budget
+        self.exploration = exploration
+        self.playout_moves = playout_moves
+        self.rng = rng
+        # Only used to draw enemy setups
+        self.sampler = MinMax(color, rng=rng, tt_size_mb=0)
+        self.root = None
+        self.nodes = 0
+        # One row per decided move: move, its visits, iterations, nodes added, visits of the
+        # reused root and seconds
+        self.stats = []
+
+    def observe(self, move):
+        """Follow a move played in the game, keeping the subtree under it"""
+        if self.root is None:
+            return
+        children = self.root.children
+        child = children.get(tuple(move)) if children else None
+        if child is not None:
+            child.parent = None
+        self.root = child
+
+    def decide_move(self, board, spy=None):
+        """Returns the most visited (row, column, target_row, target_column) move for self.color
+        on board, a Board as seen by this player"""
+        start = time.perf_counter()
+        if self.root is None or self.root.player == self.own:
+            self.root = Node(None, None, 1 - self.own)
+        root = self.root
+        reused = root.visits
+        self.nodes = 0
+        draw = self.setups(board, spy)
+        game = stratego.Game()
+        deadline = None if self.time_budget is None else start + self.time_budget
+        iteration = 0
+        while ((self.iterations is None or iteration < self.iterations)
+               and (deadline is None or iteration == 0 or time.perf_counter() < deadline)):
+            game.board = draw()
+            game.history = []
+            self.iterate(game, root)
+            iteration += 1
+        move, best = None, None
+        for child in (root.children or {}).values():
+            if best is None or child.visits > best.visits:
+                move, best = child.move, child
+        self.stats.append({"move": move,
+                           "visits": best.visits if best else 0,
+                           "iterations": iteration,
+                           "nodes": self.nodes,
+                           "reused_visits": reused,
+                           "seconds": time.perf_counter() - start})
+        return move
+
+    def setups(self, board, spy=None):
+        """Returns a function that returns a new determinisation of board on every call, drawn
+        in batches of SAMPLE_BATCH by MinMax.draw_consistent_enemy_setups"""
+        pending = []
+
+        def draw():
+            if not pending:
+                pending.extend(self.sampler.draw_consistent_enemy_setups(board, spy, SAMPLE_BATCH))
+            return pending.pop()
+        return draw
+
+    def iterate(self, game, root):
+        """One iteration: selection and expansion on game, a determinised board, then a playout
+        and backpropagation"""
+        node = root
+        rng = self.rng
+        board = game.board
+        winner = None
+        while True:
+            side = board.turn
+            moves = game.legal_moves(pieces.COLORS[side])
+            if not moves:
+                winner = 1 - side
+                break
+            if node.children is None:
+                node.children = {}
+            children = node.children
+            untried = []
+            for move in moves:
+                child = children.get(move)
+                if child is None:
+                    untried.append(move)
+                else:
+                    child.available += 1
+            if untried:
+                move = rng.choice(untried)
+                child = children[move] = Node(move, node, side)
+                child.available = 1
+                self.nodes += 1
+            else:
+                exploration = self.exploration
+                best_score = -1.0
+                child = None
+                for move in moves:
+                    c = children[move]
+                    score = c.reward / c.visits + exploration * math.sqrt(math.log(c.available) / c.visits)
+                    if score > best_score:
+                        best_score, child = score, c
+            node = child
+            defender = game.push_move(child.move)[3]
+            if defender and pieces.rank_of(defender) == pieces.FLAG:
+                winner = side
+                break
+            if untried:
+                break
+        reward = self.playout(board) if winner is None else 1.0 if winner == self.own else 0.0
+        while node is not None:
+            node.visits += 1
+            node.reward += reward if node.player == self.own else 1.0 - reward
+            node = node.parent
+
+    def playout(self, board):
+        """Plays random moves on a copy of board's cells and returns the result for self.color:
+        1 for a win, 0 for a loss and otherwise 1, 0.5 or 0 by the material balance after
+        playout_moves moves. For speed pieces move one square at a time, scouts included."""
+        cells = list(board.cells)
+        neighbours = board.neighbours
+        table = stratego.battle_table
+        rng = self.rng
+        movable = ([], [])
+        for i, c in enumerate(cells):
+            if c:
+                t = (c & pieces.TYPE_MASK) - 1
+                if t != pieces.FLAG and t != pieces.BOMB:
+                    movable[c >> 4].append(i)
+        side = board.turn
+        for _ in range(self.playout_moves):
+            own = movable[side]
+            target = None
+            for _ in range(2 * len(own)):
+                source = own[int(rng.random() * len(own))]
+                options = [t for t, move in neighbours[source] if not cells[t] or cells[t] >> 4 != side]
+                if options:
+                    target = options[int(rng.random() * len(options))]
+                    break
+            if target is None:
+                # No move found, count it as having none
+                return 0.0 if side == self.own else 1.0
+            attacker, defender = cells[source], cells[target]
+            cells[source] = pieces.EMPTY
+            own.remove(source)
+            if not defender:
+                cells[target] = attacker
+                own.append(target)
+                side ^= 1
+                continue
+            defender_type = (defender & pieces.TYPE_MASK) - 1
+            if defender_type == pieces.FLAG:
+                return 1.0 if side == self.own else 0.0
+            outcome = table[(attacker & pieces.TYPE_MASK) - 1][defender_type]
+            if outcome > 0:
+                cells[target] = attacker
+                own.append(target)
+                if defender_type != pieces.BOMB:
+                    movable[side ^ 1].remove(target)
+            elif outcome == 0:
+                cells[target] = pieces.EMPTY
+                if defender_type != pieces.BOMB:
+                    movable[side ^ 1].remove(target)
+            side ^= 1
+        balance = 0
+        for c in cells:
+            if c:
+                value = PIECE_VALUES[(c & pieces.TYPE_MASK) - 1]
+                balance += value if c >> 4 == self.own else -value
+        return 1.0 if balance > 0 else 0.0 if balance < 0 else 0.5
@@ -0,0 +1,92 @@
+import contextlib
+import io
+import random
+import unittest
+import pieces
+import stratego
+from ismcts import ISMCTS, Node
+from heuristic_tests import endgame
+
+
+class TestISMCTS(unittest.TestCase):
+
+    def test_plays_a_legal_move_within_the_iteration_budget(self):
+        random.seed(3)
+        game = stratego.Game()
+        game.board = stratego.random_board()
+        engine = ISMCTS("blue", iterations=200, rng=random.Random(3))
+        move = engine.decide_move(game.board_as_seen_by("blue"))
+        self.assertIn(move, game.legal_moves("blue"))
+        row = engine.stats[-1]
+        self.assertEqual(200, row["iterations"])
+        self.assertEqual(200, engine.root.visits)
+        self.assertEqual(row["visits"], engine.root.children[move].visits)
+
+    def test_time_budget(self):
+        random.seed(4)
+        game = stratego.Game()
+        game.board = stratego.random_board()
+        engine = ISMCTS("red", iterations=None, time_budget=0.2, rng=random.Random(4))
+        game.board.pass_turn()
+        move = engine.decide_move(game.board_as_seen_by("red"))
+        self.assertIn(move, game.legal_moves("red"))
+        self.assertGreater(engine.stats[-1]["iterations"], 0)
+        self.assertLess(engine.stats[-1]["seconds"], 1.0)
+
+    def test_captures_the_flag(self):
+        game = endgame()
+        game.set_at("red_flag", 4, 5)
+        game.remove_at(9, 9)
+        engine = ISMCTS("blue", iterations=300, rng=random.Random(1))
+        self.assertEqual((1, 5, 4, 5), engine.decide_move(game.board))
+
+    def test_tree_is_kept_under_the_moves_played(self):
+        game = endgame()
+        engine = ISMCTS("blue", iterations=300, rng=random.Random(2))
+        move = engine.decide_move(game.board)
+        game.engines["blue"] = engine
+        game.make_move(move)
+        reply = max(engine.root.children.values(), key=lambda child: child.visits)
+        visits = reply.visits
+        game.make_move(reply.move)
+        self.assertIs(reply, engine.root)
+        self.assertIsNone(engine.root.parent)
+        engine.decide_move(game.board)
+        self.assertEqual(visits, engine.stats[-1]["reused_visits"])
+        self.assertEqual(visits + 300, engine.root.visits)
+
+    def test_unexplored_reply_starts_a_new_tree(self):
+        game = endgame()
+        engine = ISMCTS("blue", iterations=50, rng=random.Random(6))
+        move = engine.decide_move(game.board)
+        engine.observe(move)
+        engine.observe((9, 9, 9, 9))
+        self.assertIsNone(engine.root)
+        game.push_move(move)
+        game.push_move(game.legal_moves("red")[0])
+        engine.decide_move(game.board)
+        self.assertEqual(0, engine.stats[-1]["reused_visits"])
+
+    def test_nodes_have_fixed_slots(self):
+        node = Node((0, 0, 1, 0), None, pieces.BLUE)
+        self.assertFalse(hasattr(node, "__dict__"))
+        with self.assertRaises(AttributeError):
+            node.score = 1
+
+    def test_select_move_plays_legal_moves(self):
+        random.seed(5)
+        game = stratego.Game()
+        game.engine_type = "ismcts"
+        game.time_budget = 0.1
+        game.board = stratego.random_board()
+        for _ in range(4):
+            player = pieces.COLORS[game.board.turn]
+            with contextlib.redirect_stdout(io.StringIO()):
+                move = game.select_move(player, game.board_as_seen_by(player))
+            self.assertIn(move, game.legal_moves(player))
+            self.assertGreater(game.engines[player].stats[-1]["iterations"], 0)
+            game.make_move(move)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+"""Local search over starting setups: steepest-ascent hill climbing and simulated annealing.
+
+The neighbourhood of a layout is every swap of two of its 40 pieces. Swaps are scored with
+delta evaluation of evaluate.defense_around_flag: a swap only changes the flag position,
+the marshal position and the bombs next to the flag, so the new score is worked out from
+precomputed tables and at most the 9 squares around the flag instead of rescanning the layout.
+Layouts are expected to hold exactly one flag and one marshal.
+"""
+import math
+import random
+import time
+
+import pieces
+
+SQUARES = 40
+BOMB = pieces.BOMB
+FLAG = pieces.FLAG
+MARSHALL = pieces.MARSHALL
+
+# NEAR[f] lists the squares within one step (diagonals included) of square f, NEAR_TABLE[f][s]
+# is 1 if s is one of them
+NEAR = [[r * 10 + c for r in range(max(0, f // 10 - 1), min(4, f // 10 + 2))
+         for c in range(max(0, f % 10 - 1), min(10, f % 10 + 2))] for f in range(SQUARES)]
+NEAR_TABLE = [[1 if s in NEAR[f] else 0 for s in range(SQUARES)] for f in range(SQUARES)]
+# Score terms that only depend on the flag square, and on the flag and marshal squares
+FLAG_TERM = [(100 if f < 10 else 0) + abs(5 - f % 10) * 10 for f in range(SQUARES)]
+DISTANCE_TERM = [[abs(14 - (abs(f // 10 - m // 10) + abs(f % 10 - m % 10))) * 10 for m in range(SQUARES)]
+                 for f in range(SQUARES)]
+SWAPS = [(a, b) for a in range(SQUARES) for b in range(a + 1, SQUARES)]
+
+
+class SwapState:
+
+    def __init__(self, layout):
+        """layout is 4 x 10 rows of piece names or a flat sequence of 40 piece types"""
+        if len(layout) == 4:
+            layout = [pieces.RANK_OF[name] for row in layout for name in row]
+        self.cells = list(layout)
+        self.flag = self.cells.index(FLAG)
+        self.marshal = self.cells.index(MARSHALL)
+        self.bombs = sum(1 for s in NEAR[self.flag] if self.cells[s] == BOMB)
+        self.score = self.full_score()
+
+    def full_score(self):
+        return FLAG_TERM[self.flag] + DISTANCE_TERM[self.flag][self.marshal] + 20 * self.bombs
+
+    def swapped(self, a, b):
+        """Returns the (flag, marshal, bombs) after swapping squares a and b"""
+        cells = self.cells
+        ta, tb = cells[a], cells[b]
+        flag = b if ta == FLAG else a if tb == FLAG else self.flag
+        marshal = b if ta == MARSHALL else a if tb == MARSHALL else self.marshal
+        if flag != self.flag:
+            bombs = 0
+            for s in NEAR[flag]:
+                t = tb if s == a else ta if s == b else cells[s]
+                if t == BOMB:
+                    bombs += 1
+        else:
+            near = NEAR_TABLE[flag]
+            bombs = self.bombs
+            if ta == BOMB:
+                bombs += near[b] - near[a]
+            if tb == BOMB:
+                bombs += near[a] - near[b]
+        return flag, marshal, bombs
+
+    def delta(self, a, b):
+        """Change in score if the pieces on squares a and b were swapped"""
+        if self.cells[a] == self.cells[b]:
+            return 0
+        flag, marshal, bombs = self.swapped(a, b)
+        return FLAG_TERM[flag] + DISTANCE_TERM[flag][marshal] + 20 * bombs - self.score
+
+    def swap(self, a, b):
+        self.flag, self.marshal, self.bombs = self.swapped(a, b)
+        self.cells[a], self.cells[b] = self.cells[b], self.cells[a]
+        self.score = self.full_score()
+
+    def layout(self):
+        """Returns the layout as 4 x 10 rows of piece names"""
+        names = [pieces.RANK_NAMES[t] for t in self.cells]
+        return [names[i:i + 10] for i in range(0, SQUARES, 10)]
+
+
+def hill_climb(layout, max_steps=None):
+    """Steepest-ascent hill climbing: apply the best improving swap until no swap improves
+    the score or max_steps swaps were made. Returns (layout, score)."""
+    state = SwapState(layout)
+    steps = 0
+    while max_steps is None or steps < max_steps:
+        best_delta, best_swap = 0, None
+        for a, b in SWAPS:
+            d = state.delta(a, b)
+            if d > best_delta:
+                best_delta, best_swap = d, (a, b)
+        if best_swap is None:
+            break
+        state.swap(*best_swap)
+        steps += 1
+    return state.layout(), state.score
+
+
+def simulated_annealing(layout, steps=100000, start_temperature=50.0, end_temperature=0.5,
+                        time_budget=None, rng=random):
+    """Simulated annealing over random swaps with a geometric cooling schedule from
+    start_temperature to end_temperature. Stops after steps swaps were tried or time_budget
+    seconds. Returns the best (layout, score) seen."""
+    state = SwapState(layout)
+    best_cells, best_score = state.cells[:], state.score
+    cooling = (end_temperature / start_temperature) ** (1.0 / max(1, steps))
+    temperature = start_temperature
+    deadline = None if time_budget is None else time.perf_counter() + time_budget
+    for step in range(steps):
+        if deadline is not None and step % 1024 == 0 and time.perf_counter() >= deadline:
+            break
+        a = rng.randrange(SQUARES)
+        b = rng.randrange(SQUARES)
+        d = state.delta(a, b)
+        if d >= 0 or rng.random() < math.exp(d / temperature):
+            state.swap(a, b)
+            if state.score > best_score:
+                best_cells, best_score = state.cells[:], state.score
+        temperature *= cooling
+    state = SwapState(best_cells)
+    return state.layout(), state.score
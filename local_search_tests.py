@@ -0,0 +1,45 @@
+import random
+import unittest
+import local_search
+from evaluate import evaluate
+from GeneticAlgorithm import genetic_algoritgm, is_board_valid
+
+
+class TestLocalSearch(unittest.TestCase):
+
+    def setUp(self):
+        random.seed(4)
+        self.ga = genetic_algoritgm(10, 1, 0.4, 0.6)
+
+    def test_delta_matches_full_evaluation(self):
+        for _ in range(20):
+            state = local_search.SwapState(self.ga.random_board_layout())
+            self.assertEqual(evaluate(state.layout()), state.score)
+            for a, b in local_search.SWAPS:
+                cells = state.cells[:]
+                cells[a], cells[b] = cells[b], cells[a]
+                expected = evaluate(local_search.SwapState(cells).layout()) - state.score
+                self.assertEqual(expected, state.delta(a, b), f"swap {a} {b}")
+            a, b = random.sample(range(40), 2)
+            state.swap(a, b)
+            self.assertEqual(evaluate(state.layout()), state.score)
+
+    def test_hill_climb_reaches_local_optimum(self):
+        layout = self.ga.random_board_layout()
+        board, score = local_search.hill_climb(layout)
+        self.assertTrue(is_board_valid(board))
+        self.assertEqual(evaluate(board), score)
+        self.assertGreaterEqual(score, evaluate(layout))
+        state = local_search.SwapState(board)
+        self.assertTrue(all(state.delta(a, b) <= 0 for a, b in local_search.SWAPS))
+
+    def test_simulated_annealing(self):
+        layout = self.ga.random_board_layout()
+        board, score = local_search.simulated_annealing(layout, steps=5000, rng=random.Random(1))
+        self.assertTrue(is_board_valid(board))
+        self.assertEqual(evaluate(board), score)
+        self.assertGreaterEqual(score, evaluate(layout))
+
+
+if __name__ == '__main__':
+    unittest.main()
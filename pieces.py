@@ -0,0 +1,75 @@
+"""Integer piece codes for the compact board representation.
+
+Every cell of a board is a single signed byte. 0 is an empty square, the low
+nibble holds the piece type + 1 and bit 4 is set for red pieces. Piece types are
+ordered by strength, so a higher type beats a lower one in ordinary combat:
+
+    0 flag, 1 spy, 2 nine (scout), 3 eight (miner), 4 seven, 5 six, 6 five,
+    7 four, 8 three, 9 two, 10 one (marshall), 11 bomb, 12 unknown ("?")
+"""
+
+EMPTY = 0
+
+BLUE = 0
+RED = 1
+COLORS = ("blue", "red")
+
+FLAG = 0
+SPY = 1
+SCOUT = 2
+MINER = 3
+MARSHALL = 10
+BOMB = 11
+UNKNOWN = 12
+NUM_TYPES = 12
+
+RANK_NAMES = ["flag", "spy", "nine", "eight", "seven", "six", "five",
+              "four", "three", "two", "one", "bomb", "?"]
+RANK_OF = {name: rank for rank, name in enumerate(RANK_NAMES)}
+
+RED_BIT = 16
+TYPE_MASK = 15
+
+
+def code(color, rank):
+    """Returns the cell code of a piece with the given color index and piece type"""
+    return (color << 4) | (rank + 1)
+
+
+def color_of(c):
+    """Returns BLUE or RED for a non-empty cell code"""
+    return c >> 4
+
+
+def rank_of(c):
+    """Returns the piece type of a non-empty cell code"""
+    return (c & TYPE_MASK) - 1
+
+
+def is_movable(c):
+    r = rank_of(c)
+    return r != FLAG and r != BOMB
+
+
+# Lookup tables between the "color_rank" strings and codes. DECODE is indexed by code.
+ENCODE = {None: EMPTY}
+DECODE = [None] * 32
+for _color, _color_name in enumerate(COLORS):
+    for _rank, _rank_name in enumerate(RANK_NAMES):
+        _code = code(_color, _rank)
+        ENCODE[f"{_color_name}_{_rank_name}"] = _code
+        DECODE[_code] = f"{_color_name}_{_rank_name}"
+del _color, _color_name, _rank, _rank_name, _code
+
+
+def encode(piece):
+    """Returns the cell code for a piece string such as "red_nine" (None is empty)"""
+    try:
+        return ENCODE[piece]
+    except KeyError:
+        raise Exception(f"UnknownPiece {piece}")
+
+
+def decode(c):
+    """Returns the piece string for a cell code (None for an empty cell)"""
+    return DECODE[c]
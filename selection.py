@@ -0,0 +1,49 @@
+"""Selection schemes for the genetic algorithm.
+
+Every scheme returns exactly n indexes into the population, so the population size stays
+constant from one generation to the next. Roulette and stochastic universal sampling build
+the cumulative weights once and then binary search them, O(P log P) per generation.
+"""
+import random
+from bisect import bisect_right
+from itertools import accumulate
+
+
+def roulette(weights, n, rng=random):
+    """Draw n indexes independently, each with probability proportional to its weight"""
+    cumulative = list(accumulate(weights))
+    total = cumulative[-1]
+    last = len(cumulative) - 1
+    return [min(bisect_right(cumulative, rng.random() * total), last) for _ in range(n)]
+
+
+def stochastic_universal(weights, n, rng=random):
+    """Stochastic universal sampling: n equally spaced pointers with a single random offset,
+    so every index is picked within one of its expected number of copies"""
+    cumulative = list(accumulate(weights))
+    total = cumulative[-1]
+    last = len(cumulative) - 1
+    step = total / n
+    start = rng.random() * step
+    selected = []
+    x = 0
+    for i in range(n):
+        pointer = start + i * step
+        while x < last and cumulative[x] <= pointer:
+            x += 1
+        selected.append(x)
+    return selected
+
+
+def tournament(scores, n, size=3, rng=random):
+    """Draw n indexes, each the fittest of size indexes picked uniformly at random"""
+    population = len(scores)
+    selected = []
+    for _ in range(n):
+        best = rng.randrange(population)
+        for _ in range(size - 1):
+            challenger = rng.randrange(population)
+            if scores[challenger] > scores[best]:
+                best = challenger
+        selected.append(best)
+    return selected
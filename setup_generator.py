@@ -0,0 +1,62 @@
+"""Bulk generator for valid random starting setups.
+
+A valid setup is a permutation of the fixed 40 piece multiset, so instead of drawing pieces
+until every quota is met, whole batches are produced by permuting an (N, 40) array of piece
+types in one numpy call.
+"""
+import random
+
+import numpy as np
+
+import pieces
+import utils
+
+STARTING_QUANTITIES = {"bomb"  : 6,
+                       "one"   : 1,
+                       "two"   : 1,
+                       "three" : 2,
+                       "four"  : 3,
+                       "five"  : 4,
+                       "six"   : 4,
+                       "seven" : 4,
+                       "eight" : 5,
+                       "nine"  : 8,
+                       "spy"   : 1,
+                       "flag"  : 1}
+
+# The 40 pieces of a setup, as piece names and as piece types
+SETUP_NAMES = [name for name, n in STARTING_QUANTITIES.items() for _ in range(n)]
+SETUP_TYPES = np.array([pieces.RANK_OF[name] for name in SETUP_NAMES], dtype=np.int8)
+
+
+def random_layout(rng=random):
+    """Returns one random layout as 4 x 10 rows of piece names"""
+    names = rng.sample(SETUP_NAMES, len(SETUP_NAMES))
+    return [names[i:i + 10] for i in range(0, 40, 10)]
+
+
+def random_layouts(n, seed=None):
+    """Returns n random layouts as a (n, 4, 10) int8 array of piece types. seed is anything
+    utils.rng_from_seed accepts."""
+    rng = utils.rng_from_seed(seed)
+    layouts = np.tile(SETUP_TYPES, (n, 1))
+    rng.permuted(layouts, axis=1, out=layouts)
+    return layouts.reshape(n, 4, 10)
+
+
+def layouts_to_cells(blue, red):
+    """Returns (n, 100) int8 board cells (see stratego.Board) with the blue layouts on rows 0-3
+    and the red layouts turned around on rows 6-9, so both back rows are on the board edges"""
+    blue = np.asarray(blue, dtype=np.int8).reshape(-1, 40)
+    red = np.asarray(red, dtype=np.int8).reshape(-1, 40)
+    cells = np.zeros((len(blue), 100), dtype=np.int8)
+    cells[:, :40] = blue + 1
+    cells[:, 60:] = (red[:, ::-1] + 1) | pieces.RED_BIT
+    return cells
+
+
+def random_boards(n, seed=None):
+    """Returns n random two sided starting positions as a (n, 100) int8 array of board cells"""
+    rng = utils.rng_from_seed(seed)
+    layouts = random_layouts(2 * n, rng)
+    return layouts_to_cells(layouts[:n], layouts[n:])
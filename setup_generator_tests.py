@@ -0,0 +1,39 @@
+import unittest
+import numpy as np
+import pieces
+import setup_generator
+import stratego
+from GeneticAlgorithm import is_board_valid, decode_population
+
+
+class TestSetupGenerator(unittest.TestCase):
+
+    def test_random_layouts_are_valid(self):
+        layouts = setup_generator.random_layouts(500, 3)
+        self.assertEqual((500, 4, 10), layouts.shape)
+        self.assertEqual(np.int8, layouts.dtype)
+        counts = np.sort(layouts.reshape(500, 40), axis=1)
+        self.assertTrue((counts == np.sort(setup_generator.SETUP_TYPES)).all())
+        self.assertGreater(len(set(map(bytes, layouts))), 490)
+        self.assertTrue((layouts == setup_generator.random_layouts(500, 3)).all(), "Same seed, same layouts")
+        for board in decode_population(layouts[:20]):
+            self.assertTrue(is_board_valid(board))
+        self.assertTrue(is_board_valid(setup_generator.random_layout()))
+
+    def test_random_boards(self):
+        cells = setup_generator.random_boards(50, 9)
+        self.assertEqual((50, 100), cells.shape)
+        for row in cells[:5]:
+            board = stratego.Board.from_cells(row)
+            game = stratego.Game()
+            game.board = board
+            self.assertFalse(game.game_over())
+            blue = [[board.board[i][j].split("_")[1] for j in range(10)] for i in range(4)]
+            red = [[board.board[9 - i][9 - j].split("_")[1] for j in range(10)] for i in range(4)]
+            self.assertTrue(is_board_valid(blue))
+            self.assertTrue(is_board_valid(red))
+            self.assertTrue(all(c == pieces.EMPTY for c in board.cells[40:60]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,176 @@
+"""Persistent library of evolved starting setups.
+
+Evolving a setup with the genetic algorithm takes far too long to do for every game, so the
+GA is run offline and the best distinct layouts are written to a small binary file that
+create_new_board samples from:
+
+    python setup_library.py build   [--out setups.bin] [--top-k 500] [--runs 5] ...
+    python setup_library.py refresh [--out setups.bin] [--top-k 500] [--runs 5] ...
+    python setup_library.py show    [--out setups.bin] [--index 0]
+
+build replaces the library with the results of fresh GA runs, refresh runs the GA again and
+merges the results with the layouts already in the library.
+
+File format: a 16 byte header (8 byte magic, uint32 version, uint32 count) followed by count
+records of a float32 fitness and 40 int8 piece types (pieces.py), best fitness first.
+"""
+import argparse
+import functools
+import os
+import random
+
+import numpy as np
+
+import pieces
+import symmetry
+from GeneticAlgorithm import genetic_algoritgm
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "setups.bin")
+
+MAGIC = b"STRSETUP"
+VERSION = 1
+HEADER = np.dtype([("magic", "S8"), ("version", "<u4"), ("count", "<u4")])
+RECORD = np.dtype([("fitness", "<f4"), ("layout", "i1", (40,))])
+
+
+def encode_layout(layout):
+    """Returns the 40 piece types of a 4 x 10 layout of piece names"""
+    return [pieces.RANK_OF[name] for row in layout for name in row]
+
+
+def decode_layout(types):
+    """Returns the 4 x 10 layout of piece names for 40 piece types"""
+    names = [pieces.RANK_NAMES[t] for t in types]
+    return [names[i:i + 10] for i in range(0, 40, 10)]
+
+
+class SetupLibrary:
+    def __init__(self, path=DEFAULT_PATH):
+        """Memory maps the setup library at path"""
+        header = np.fromfile(path, dtype=HEADER, count=1)
+        if len(header) != 1 or header["magic"][0] != MAGIC:
+            raise Exception(f"NotASetupLibrary {path}")
+        if header["version"][0] != VERSION:
+            raise Exception(f"UnsupportedSetupLibraryVersion {header['version'][0]} in {path}")
+        self.path = path
+        self.count = int(header["count"][0])
+        if self.count == 0:
+            raise Exception(f"EmptySetupLibrary {path}")
+        self.records = np.memmap(path, dtype=RECORD, mode="r", offset=HEADER.itemsize, shape=(self.count,))
+
+    def __len__(self):
+        return self.count
+
+    def layout(self, index):
+        """Returns the layout at index as 4 x 10 rows of piece names. Index 0 is the fittest."""
+        return decode_layout(self.records["layout"][index].tolist())
+
+    def fitness(self, index):
+        return float(self.records["fitness"][index])
+
+    def sample(self, rng=random):
+        """Returns (index, layout) of a uniformly chosen setup"""
+        index = rng.randrange(self.count)
+        return index, self.layout(index)
+
+
+@functools.lru_cache(maxsize=None)
+def load(path=DEFAULT_PATH):
+    """Returns the SetupLibrary at path, opened once per process"""
+    return SetupLibrary(path)
+
+
+def write(path, scored_layouts):
+    """Write (fitness, layout) pairs to path, best first. The file is replaced atomically so
+    readers holding the old mapping are not affected."""
+    scored_layouts = sorted(scored_layouts, key=lambda s: s[0], reverse=True)
+    header = np.zeros(1, dtype=HEADER)
+    header["magic"] = MAGIC
+    header["version"] = VERSION
+    header["count"] = len(scored_layouts)
+    records = np.zeros(len(scored_layouts), dtype=RECORD)
+    for i, (fitness, layout) in enumerate(scored_layouts):
+        records[i]["fitness"] = fitness
+        records[i]["layout"] = encode_layout(layout)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(header.tobytes())
+        f.write(records.tobytes())
+    os.replace(tmp, path)
+    load.cache_clear()
+
+
+def distinct(seen):
+    """Drops mirror images from seen (layout tuples to fitness), keeping the fitter orientation
+    of every pair. Returns a new dict."""
+    best = {}
+    for key, fitness in seen.items():
+        canonical = symmetry.canonical_layout_key(decode_layout(key))
+        if canonical not in best or fitness > best[canonical][1]:
+            best[canonical] = (key, fitness)
+    return dict(best.values())
+
+
+def evolve(top_k, runs, population_size, generations, mutation_rate, crossover_rate, seen=None,
+           time_budget=None, stall_generations=None):
+    """Runs the GA up to runs times and returns up to top_k distinct (fitness, layout) pairs.
+    A layout and its mirror image are the same setup, only the fitter orientation is kept.
+    seen maps the layouts already collected (as tuples of piece types) to their fitness.
+    time_budget and stall_generations apply to each run, see genetic_algoritgm.execute."""
+    seen = dict(seen or {})
+    for _ in range(runs):
+        ga = genetic_algoritgm(population_size, generations, mutation_rate, crossover_rate)
+        ga.execute(timeBudget=time_budget, stallGenerations=stall_generations)
+        for layout in ga.population:
+            for oriented in (layout, symmetry.mirror_layout(layout)):
+                key = tuple(encode_layout(oriented))
+                if key not in seen:
+                    seen[key] = ga.evaluate(oriented)
+    best = sorted(distinct(seen).items(), key=lambda item: item[1], reverse=True)[:top_k]
+    return [(fitness, decode_layout(key)) for key, fitness in best]
+
+
+def build(path, top_k, runs, population_size, generations, mutation_rate, crossover_rate, refresh=False,
+          time_budget=None, stall_generations=None):
+    seen = {}
+    if refresh and os.path.exists(path):
+        library = SetupLibrary(path)
+        for i in range(len(library)):
+            seen[tuple(library.records["layout"][i].tolist())] = library.fitness(i)
+    scored = evolve(top_k, runs, population_size, generations, mutation_rate, crossover_rate, seen,
+                    time_budget, stall_generations)
+    write(path, scored)
+    return len(scored)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and inspect the starting setup library")
+    parser.add_argument("command", choices=["build", "refresh", "show"])
+    parser.add_argument("--out", default=DEFAULT_PATH, help="library file")
+    parser.add_argument("--top-k", type=int, default=500, help="number of distinct setups to keep")
+    parser.add_argument("--runs", type=int, default=5, help="number of GA runs")
+    parser.add_argument("--population", type=int, default=100)
+    parser.add_argument("--generations", type=int, default=10000)
+    parser.add_argument("--mutation-rate", type=float, default=0.4)
+    parser.add_argument("--crossover-rate", type=float, default=0.6)
+    parser.add_argument("--time-budget", type=float, default=None, help="seconds per GA run")
+    parser.add_argument("--stall", type=int, default=None,
+                        help="stop a GA run after this many generations without improvement")
+    parser.add_argument("--index", type=int, default=0, help="setup to show")
+    args = parser.parse_args()
+
+    if args.command == "show":
+        library = SetupLibrary(args.out)
+        print(f"{len(library)} setups, #{args.index} fitness {library.fitness(args.index)}")
+        for row in library.layout(args.index):
+            print(row)
+        return
+
+    n = build(args.out, args.top_k, args.runs, args.population, args.generations,
+              args.mutation_rate, args.crossover_rate, refresh=args.command == "refresh",
+              time_budget=args.time_budget, stall_generations=args.stall)
+    print(f"Wrote {n} setups to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import os
+import tempfile
+import unittest
+import setup_library
+import stratego
+from evaluate import evaluate
+from GeneticAlgorithm import is_board_valid
+
+
+class TestSetupLibrary(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "setups.bin")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def build(self, refresh=False):
+        return setup_library.build(self.path, 20, 1, 20, 5, 0.4, 0.6, refresh=refresh)
+
+    def test_build_and_load(self):
+        n = self.build()
+        library = setup_library.SetupLibrary(self.path)
+        self.assertEqual(n, len(library))
+        self.assertEqual(os.path.getsize(self.path), 16 + 44 * n)
+        layouts = [tuple(map(tuple, library.layout(i))) for i in range(len(library))]
+        self.assertEqual(len(layouts), len(set(layouts)), "Setups should be distinct")
+        self.assertFalse(set(tuple(tuple(row[::-1]) for row in layout) for layout in layouts) & set(layouts),
+                         "Mirror images are the same setup")
+        for i in range(len(library)):
+            self.assertTrue(is_board_valid(library.layout(i)))
+            self.assertEqual(evaluate(library.layout(i)), library.fitness(i))
+            if i > 0:
+                self.assertGreaterEqual(library.fitness(i - 1), library.fitness(i), "Best setups come first")
+
+    def test_refresh_keeps_the_best(self):
+        self.build()
+        best = setup_library.SetupLibrary(self.path).fitness(0)
+        self.build(refresh=True)
+        library = setup_library.SetupLibrary(self.path)
+        self.assertGreaterEqual(library.fitness(0), best)
+        self.assertLessEqual(len(library), 20)
+
+    def test_create_new_board_by_index(self):
+        self.build()
+        library = setup_library.load(self.path)
+        board = stratego.create_new_board(self.path, blue_index=0, red_index=1)
+        self.assertEqual("blue_" + library.layout(0)[0][0], board.get_from(0, 0))
+        self.assertEqual("red_" + library.layout(1)[0][0], board.get_from(9, 9))
+        again = stratego.create_new_board(self.path, blue_index=0, red_index=1)
+        self.assertEqual(board.cells, again.cells)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -33,10 +33,10 @@ class Spy:
             for column, piece in enumerate(columns):                
                 if piece is None:
                     continue
-                p = self.normalize_piece(piece)
-                if self.is_known_piece(p) and self.color is None:
-                    self.color = self.piece_color(piece)
-                    self.enemy_color = self.opposite_color(self.color)
+                if self.is_known_piece(piece):
+                    if self.color is None:
+                        self.color = self.piece_color(piece)
+                        self.enemy_color = self.opposite_color(self.color)
                 else:
                     self.state[(row,column)] = starting_distribution.copy()             
     
@@ -69,7 +69,7 @@ class Spy:
         return dist
 
     def rebuild_state_distribution(self):
-        counts_of_unknown_pieces = self.remaining_enemy_pieces
+        counts_of_unknown_pieces = defaultdict(lambda:0, self.remaining_enemy_pieces)
         counts_of_possible_locations = defaultdict(lambda:0)
         
         #remove known items from distribution
@@ -139,35 +139,29 @@ class Spy:
                 self.state[(end_row, end_column)] = {"nine" : 1.0}
             else:
                 self.state[(end_row, end_column)] = self.state[(start_row, start_column)]
-                self.remove_bomb_or_flag_probabilities(end_row, end_column)
+                if len(self.state[(end_row, end_column)]) > 1:
+                    self.remove_bomb_or_flag_probabilities(end_row, end_column)
             self.state.pop((start_row, start_column))
             self.rebuild_state_distribution()
             return
 
-        p = self.normalize_piece(remained)
-        self.state[(end_row,end_column)] = {p : 1.0}
         self.state.pop((start_row, start_column))
-
-        discovered_piece = self.normalize_piece(removed)
-        if self.piece_color(removed) == self.color:
-            discovered_piece = self.normalize_piece(remained)
-            
-        self.remaining_enemy_pieces[discovered_piece] -= 1
+        if self.is_enemy_piece(remained):
+            # The attacker won and is now known
+            self.state[(end_row,end_column)] = {self.normalize_piece(remained) : 1.0}
+        else:
+            self.remaining_enemy_pieces[self.normalize_piece(removed)] -= 1
 
     def __on_player_turn(self, start_row, start_column, end_row, end_column, remained=None, removed=None):
         if removed is None:
             return
 
-        enemy_piece = removed
-        if not self.is_enemy_piece(enemy_piece):
-            enemy_piece = remained
-
-        p = self.normalize_piece(enemy_piece)
-        self.state[(end_row,end_column)] = {p : 1.0}            
-        self.remaining_enemy_pieces[p] -= 1
-
-            
-            
+        if self.is_enemy_piece(remained):
+            # The defender won and is now known
+            self.state[(end_row,end_column)] = {self.normalize_piece(remained) : 1.0}
+        else:
+            self.state.pop((end_row, end_column), None)
+            self.remaining_enemy_pieces[self.normalize_piece(removed)] -= 1
 
     def is_enemy_piece(self, piece):
         color = self.piece_color(piece)
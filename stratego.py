@@ -1,52 +1,178 @@
 import os
 import random
-from collections import defaultdict
+from array import array
 from GeneticAlgorithm import genetic_algoritgm
-from heuristic import Heuristic
+import pieces
+import setup_generator
+import setup_library
+from spy import Spy
+import utils
+
+
+def ray_tables(size, no_mans_land):
+    """For every square index (row * size + column) returns the rays of squares reachable in a
+    straight line before hitting the board edge or no-man's land. Each ray is a tuple of
+    (target_index, move) pairs where move is the (row, column, target_row, target_column)
+    tuple taken by Game.make_move. Squares in no-man's land have no rays."""
+    rays = []
+    for row in range(size):
+        for column in range(size):
+            square_rays = []
+            if (row, column) not in no_mans_land:
+                for d_row, d_column in ((-1, 0), (1, 0), (0, -1), (0, 1)):
+                    ray = []
+                    r, c = row + d_row, column + d_column
+                    while 0 <= r < size and 0 <= c < size and (r, c) not in no_mans_land:
+                        ray.append((r * size + c, (row, column, r, c)))
+                        r, c = r + d_row, c + d_column
+                    if ray:
+                        square_rays.append(tuple(ray))
+            rays.append(tuple(square_rays))
+    return tuple(rays)
+
+
+def zobrist_keys(size, seed=5100):
+    """Returns the random 64-bit Zobrist keys for a size x size board, as a flat list indexed
+    by square_index * 32 + piece_code (empty squares have key 0), and the side to move key."""
+    rng = random.Random(seed)
+    keys = []
+    for _ in range(size * size):
+        keys.append(0)
+        keys.extend(rng.getrandbits(64) for _ in range(31))
+    return keys, rng.getrandbits(64)
+
+
+def mirror_table(size):
+    """Returns the square index of the left-right mirror image of every square"""
+    return tuple(r * size + size - 1 - c for r in range(size) for c in range(size))
+
+
 class Board:
+    size = 10
+    no_mans_land = frozenset([(4,2),(4,3),(5,2),(5,3),(4,6),(4,7),(5,6),(5,7)])
+    # Precomputed move tables, shared by every board
+    rays = ray_tables(size, no_mans_land)
+    neighbours = tuple(tuple(ray[0] for ray in square) for square in rays)
+    zobrist, zobrist_turn = zobrist_keys(size)
+    mirror_squares = mirror_table(size)
+    piece_name_conversion = {
+        "flag"  : "F",
+        "spy"   : "S",
+        "one"   : "1",
+        "two"   : "2",
+        "three" : "3",
+        "four"  : "4",
+        "five"  : "5",
+        "six"   : "6",
+        "seven" : "7",
+        "eight" : "8",
+        "nine"  : "9",
+        "bomb"  : "B",
+        "?"     : "?" }
 
     def __init__(self):
-        """Initialize a new board"""
-        self.board = []
-        self.size = 10
-        self.no_mans_land = set([(4,2),(4,3),(5,2),(5,3),(4,6),(4,7),(5,6),(5,7)])
-        self.piece_name_conversion = {
-            "flag"  : "F",
-            "spy"   : "S",
-            "one"   : "1",
-            "two"   : "2",
-            "three" : "3",
-            "four"  : "4",
-            "five"  : "5",
-            "six"   : "6",
-            "seven" : "7",
-            "eight" : "8",
-            "nine"  : "9",
-            "bomb"  : "B",
-            "?"     : "?" }
+        """Initialize a new board.
+
+        The board is stored as a flat array of size * size signed bytes holding the
+        integer piece codes from pieces.py, indexed by row * size + column. The
+        string based methods below are a thin adapter over those codes.
+
+        The board also carries the side to move (pieces.BLUE moves first) and a 64-bit
+        Zobrist hash of the pieces and the side to move that is kept up to date by every
+        write, see hash(). mirror_key is the hash of the board's left-right mirror image.
+        """
+        self.cells = None
+        self.turn = pieces.BLUE
+        self.key = 0
+        self.mirror_key = 0
         self.initialize()
         
 
     def initialize(self):
-        """Create an empty board and fill it with None"""
-        self.board = []
-        for _ in range(self.size):
-            self.board.append([None for _ in range(self.size)])        
+        """Create an empty board"""
+        self.cells = array("b", bytes(self.size * self.size))
+        self.rehash()
+
+    @classmethod
+    def from_cells(cls, cells):
+        """Returns a board holding a copy of size * size piece codes, e.g. a row of
+        setup_generator.random_boards"""
+        b = cls()
+        b.cells = array("b", bytes(cells))
+        b.rehash()
+        return b
+
+    def hash(self):
+        """Returns the 64-bit Zobrist hash of the position and the side to move"""
+        return self.key
+
+    def canonical_hash(self):
+        """Returns the same hash for the position and its left-right mirror image"""
+        return min(self.key, self.mirror_key)
+
+    def rehash(self):
+        """Recompute the hash from scratch. Only needed after writing to cells directly."""
+        keys = self.zobrist
+        mirror = self.mirror_squares
+        key = self.zobrist_turn if self.turn == pieces.RED else 0
+        mirror_key = key
+        for i, c in enumerate(self.cells):
+            key ^= keys[i * 32 + c]
+            mirror_key ^= keys[mirror[i] * 32 + c]
+        self.key = key
+        self.mirror_key = mirror_key
+
+    def put(self, index, c):
+        """Write the piece code c at the square index, updating the hash incrementally"""
+        cells = self.cells
+        keys = self.zobrist
+        old = cells[index]
+        self.key ^= keys[index * 32 + old] ^ keys[index * 32 + c]
+        m = self.mirror_squares[index] * 32
+        self.mirror_key ^= keys[m + old] ^ keys[m + c]
+        cells[index] = c
+
+    def pass_turn(self):
+        """Hand the move to the other side"""
+        self.turn ^= 1
+        self.key ^= self.zobrist_turn
+        self.mirror_key ^= self.zobrist_turn
+
+    @property
+    def board(self):
+        """The board as rows of piece strings (None for empty squares). This is a copy,
+        use set_at/remove_at to change the board."""
+        size = self.size
+        decode = pieces.DECODE
+        cells = self.cells
+        return [[decode[c] for c in cells[r * size:(r + 1) * size]] for r in range(size)]
+
+    @board.setter
+    def board(self, rows):
+        self.initialize()
+        for row, columns in enumerate(rows):
+            for column, piece in enumerate(columns):
+                self.cells[row * self.size + column] = pieces.encode(piece)
+        self.rehash()
         
     def set_at(self, piece, row, column):
         """Set the given piece at row, column. (0,0) is the upper left corner of the board"""
         if self.is_inbounds(row, column):
-            self.board[row][column] = piece
+            self.put(row * self.size + column, pieces.encode(piece))
         else:
             raise(f"BoardLocationOutOfBounds ({row},{column})")
 
+    def code_at(self, row, column):
+        """Returns the integer piece code at (row, column), 0 if the location is empty"""
+        if not self.is_inbounds(row, column):
+            raise Exception(f"BoardLocationOutOfBounds ({row},{column})")
+        return self.cells[row * self.size + column]
+
     def is_occuppied(self, row, column):
         """Returns the piece at (row, column) or False if the location is empty"""
-        if not self.is_inbounds(row, column):
-            raise(f"BoardLocationOutOfBounds ({row},{column})")
-        p = self.board[row][column]
-        if p:
-            return p
+        c = self.code_at(row, column)
+        if c:
+            return pieces.DECODE[c]
         return False
 
     def get_from(self, row, column):
@@ -61,14 +187,14 @@ class Board:
         if not self.is_inbounds(row, column):
             raise(f"BoardLocationOutOfBounds ({row},{column})")
         
-        self.board[row][column] = None
+        self.put(row * self.size + column, pieces.EMPTY)
 
     def reduce(self, f, init_value=None):
         """Run reduce over the board. This is a very flexible iterator abstraction over the board."""
         acc = init_value
-        for row in self.board:
-            for piece in row:
-                acc = f(piece, acc)
+        decode = pieces.DECODE
+        for c in self.cells:
+            acc = f(decode[c], acc)
         return acc
 
     def is_inbounds(self, row, column):
@@ -77,10 +203,11 @@ class Board:
 
     def clone(self):
         """Returns a new board with an identical layout as the current board"""
-        c = Board()
-        c.board = []
-        for row in self.board:
-            c.board.append(row[:])
+        c = Board.__new__(Board)
+        c.cells = self.cells[:]
+        c.turn = self.turn
+        c.key = self.key
+        c.mirror_key = self.mirror_key
         return c
 
             
@@ -94,7 +221,7 @@ class Board:
             start_column += 0 if start_column == end_column else 1
             if (start_row == end_row and start_column == end_column):
                 return True
-            elif self.is_occuppied(start_row, start_column):
+            elif self.cells[start_row * self.size + start_column]:
                 return False
             elif (start_row, start_column) in self.no_mans_land:
                 return False
@@ -116,6 +243,12 @@ class Board:
         return b
         
 
+# utils.get_bm() as nested lists, scalar lookups on lists are much cheaper than on numpy arrays
+battle_table = utils.get_bm().tolist()
+# Seconds per move of the engines created by Game.select_move
+DEFAULT_TIME_BUDGET = 1.0
+
+
 class Game:
     def __init__(self):
         self.piece_value_lookup = {
@@ -133,6 +266,20 @@ class Game:
             "bomb"  : 100 }
 
         self.board = Board()
+        # Undo records (source, target, attacker, defender, victor) of the moves played
+        # with push_move. Squares are board indexes and pieces are integer codes.
+        self.history = []
+        # Search engine of each player, the kind of engine to create ("minmax", "expectimax" or "ismcts")
+        # and its seconds per move. The alpha-beta engines search no deeper than search_depth plies
+        # if given. With time_budget None they search to exactly that depth, or to one set by the
+        # number of enemy pieces. See select_move.
+        self.engines = {}
+        self.engine_type = "minmax"
+        self.time_budget = DEFAULT_TIME_BUDGET
+        self.search_depth = None
+        # What each player has learned about the enemy's hidden pieces, kept by make_move from
+        # the first move on and passed to the engines
+        self.spies = {}
 
     def is_bomb(self, piece):
         return "bomb" in piece
@@ -166,36 +313,36 @@ class Game:
         return b
     
     def attack(self, attacker, defender):
-        """Return the piece that is victorious"""
+        """Return the piece that is victorious (None if both pieces die)"""
         if self.same_color(attacker, defender):
             raise Exception("Illegal to attack teammates!")
-        if self.is_bomb(attacker):
+        return pieces.decode(self.attack_codes(pieces.encode(attacker), pieces.encode(defender)))
+
+    def attack_codes(self, attacker, defender):
+        """Same as attack, for integer piece codes of known pieces. Returns the victor's code,
+        or pieces.EMPTY if both die."""
+        outcome = battle_table[(attacker & pieces.TYPE_MASK) - 1][(defender & pieces.TYPE_MASK) - 1]
+        if outcome == utils.ATTACKER_WINS:
             return attacker
-        elif self.is_bomb(defender):
-            if self.is_miner(attacker):
-                return attacker
+        elif outcome == utils.DEFENDER_WINS:
             return defender
-        elif self.is_spy(attacker):
-            if self.is_marshall(defender):
-                return attacker
-        
-        return self.stronger_piece(attacker, defender)
+        return pieces.EMPTY
 
     def is_valid_move(self, row, column, target_row, target_column):
         """Returns True if the piece at (row,column) is allowed to move to (target_row, target_column)"""
         #print(f"({row},{column}) -> ({target_row},{target_column})")
-        p = self.is_occuppied(row, column)
+        p = self.board.code_at(row, column)
         if not p:
             raise Exception(f"MoveInvalid - no piece located at ({row}, {column}).")
 
         if self.in_no_mans_land(target_row, target_column):
             return False
         # Check if we are trying to move an immobile piece
-        elif self.is_bomb(p) or self.is_flag(p):
+        elif not pieces.is_movable(p):
             return False
         # Check if location is already occuppied by same color piece
-        elif self.is_occuppied(target_row, target_column):
-            return self.color_at(row, column) != self.color_at(target_row, target_column)
+        elif self.board.code_at(target_row, target_column):
+            return pieces.color_of(p) != pieces.color_of(self.board.code_at(target_row, target_column))
         # Check for moving in-place
         elif row == target_row and column == target_column:
             return False 
@@ -205,11 +352,42 @@ class Game:
         # Check for moving more than 1 space
         elif abs(row - target_row) > 1 or abs(column - target_column) > 1:
             # Allow the scout to move > 1 space
-            if self.is_scout(p):
+            if pieces.rank_of(p) == pieces.SCOUT:
                 return self.is_path_clear(row, column, target_row, target_column)
             return False
         return True
 
+    def legal_moves(self, color):
+        """Returns every legal (row, column, target_row, target_column) move for color,
+        generated in a single pass over the board using the precomputed move tables"""
+        own = pieces.COLORS.index(color)
+        cells = self.board.cells
+        rays = self.board.rays
+        neighbours = self.board.neighbours
+        moves = []
+        for i, p in enumerate(cells):
+            # Inlined pieces.color_of / pieces.rank_of, this loop runs every ply
+            if not p or p >> 4 != own:
+                continue
+            rank = (p & pieces.TYPE_MASK) - 1
+            if rank == pieces.FLAG or rank == pieces.BOMB:
+                continue
+            if rank == pieces.SCOUT:
+                for ray in rays[i]:
+                    for t, move in ray:
+                        q = cells[t]
+                        if q and q >> 4 == own:
+                            break
+                        moves.append(move)
+                        if q:
+                            break
+            else:
+                for t, move in neighbours[i]:
+                    q = cells[t]
+                    if not q or q >> 4 != own:
+                        moves.append(move)
+        return moves
+
     def same_color(self, piece1, piece2):
         return self.color_of(piece1) == self.color_of(piece2)
     
@@ -240,6 +418,9 @@ class Game:
     def in_no_mans_land(self, row, column):
         return (row,column) in self.board.no_mans_land
 
+    def code_at(self, row, column):
+        return self.board.code_at(row, column)
+
     def board_contains(self, predicate):
         f = lambda p, acc: acc or predicate(p)
         return self.board.reduce(f, False)
@@ -251,12 +432,12 @@ class Game:
 
     def game_over(self):
         """If game is over return winner color or 'tie' - else return False"""
-        if not self.on_board("red_flag"):
+        cells = self.board.cells
+        if pieces.code(pieces.RED, pieces.FLAG) not in cells:
             return "blue" 
-        elif not self.on_board("blue_flag"):
+        elif pieces.code(pieces.BLUE, pieces.FLAG) not in cells:
             return "red"
-        movable_entries = lambda p: p is not None and self.is_movable(p)
-        if not self.board_contains(movable_entries):
+        if not any(c and pieces.is_movable(c) for c in cells):
             return "tie"
         return False
 
@@ -264,27 +445,54 @@ class Game:
         opposite_color = "blue"
         if color == opposite_color:
             opposite_color = "red"
+        own = pieces.COLORS.index(color)
+        hidden = pieces.code(pieces.COLORS.index(opposite_color), pieces.UNKNOWN)
         clone = self.board.clone()
-        for row in clone.board:
-            for i in range(len(row)):
-                if row[i] is not None and color not in row[i]:
-                    row[i] = opposite_color + "_?"
+        cells = clone.cells
+        for i, c in enumerate(cells):
+            if c and pieces.color_of(c) != own:
+                cells[i] = hidden
+        clone.rehash()
         return clone
 
     def start(self):
+        """Plays the game out and returns the winner's color or 'tie'"""
         player = "blue"
         while (not self.game_over()):
             self.display_board()
+            if not self.legal_moves(player):
+                # A player who cannot move loses, the engines would have no move to return
+                return self.next_turn(player)
             b = self.board_as_seen_by(player)
             move = self.select_move(player, b)
             self.make_move(move)
             player = self.next_turn(player)
+        return self.game_over()
 
     def select_move(self, player, board):
+        """Returns the move of the search engine playing player on board, the board as seen by player"""
+        # Deferred so that importing stratego does not pay for the search dependencies
+        from heuristic import MinMax, Expectimax
+        from ismcts import ISMCTS
         print(f"======{player} Perspective============")
-        move = Heuristic.get_best_board(board, player)
         print(board)
-        return (3,0,4,0)
+        engine = self.engines.get(player)
+        if engine is None:
+            engine_class = {"minmax": MinMax, "expectimax": Expectimax, "ismcts": ISMCTS}[self.engine_type]
+            options = {"time_budget": self.time_budget}
+            if engine_class is not ISMCTS:
+                options["depth"] = self.search_depth
+            engine = self.engines[player] = engine_class(player, **options)
+        self.watch()
+        move = engine.decide_move(board, self.spies[player])
+        stats = engine.stats[-1]
+        if "iterations" in stats:
+            print(f"{move} {stats['visits']} of {stats['iterations']} iterations, {stats['nodes']} new nodes "
+                  f"in {stats['seconds']:.2f}s")
+            return move
+        print(f"{move} score {stats['score']} depth {stats['depth']}: {stats['nodes']} nodes "
+              f"in {stats['seconds']:.2f}s ({stats['nodes'] / max(stats['seconds'], 1e-9):.0f} nodes/s)")
+        return move
 
     def next_turn(self, player):
         if "red" in player:
@@ -301,91 +509,110 @@ class Game:
         if not self.is_valid_move(row, column, target_row, target_column):
             raise Exception("Requested illegal move!")
         
-        attacker = self.get_from(row, column)
-        if self.is_occuppied(target_row, target_column):
-            defender = self.get_from(target_row, target_column)
-            victor = self.attack(attacker, defender)
-            self.set_at(victor, target_row, target_column)
-        else:
-            self.set_at(attacker, target_row, target_column)
-        self.remove_at(row, column)
+        self.watch()
+        source, target, attacker, defender, victor = self.push_move(move)
+        remained = removed = None
+        if defender:
+            remained = pieces.DECODE[victor]
+            removed = pieces.DECODE[defender if victor == attacker else attacker]
+        for spy in self.spies.values():
+            spy.update(row, column, target_row, target_column, remained, removed)
+        for engine in self.engines.values():
+            engine.observe(move)
+
+    def watch(self):
+        """Creates the players' spies from the current board if they do not exist yet"""
+        if not self.spies:
+            for color in pieces.COLORS:
+                self.spies[color] = Spy(self.board_as_seen_by(color).board)
+
+    def push_move(self, move):
+        """Play move and push its undo record on the history so pop_move can take it back.
+        The move is not validated - it should come from legal_moves or pass is_valid_move."""
+        row, column, target_row, target_column = move
+        board = self.board
+        size = board.size
+        cells = board.cells
+        source = row * size + column
+        target = target_row * size + target_column
+        attacker = cells[source]
+        defender = cells[target]
+        victor = attacker
+        if defender:
+            victor = self.attack_codes(attacker, defender)
+        board.put(target, victor)
+        board.put(source, pieces.EMPTY)
+        board.pass_turn()
+        record = (source, target, attacker, defender, victor)
+        self.history.append(record)
+        return record
+
+    def pop_move(self):
+        """Undo the last move played with push_move and return its undo record"""
+        if not self.history:
+            raise Exception("NoMoveToUndo")
+        record = self.history.pop()
+        source, target, attacker, defender, victor = record
+        board = self.board
+        board.put(source, attacker)
+        board.put(target, defender)
+        board.pass_turn()
+        return record
 
 
 
 def random_board():
-    names_of_pieces = ["spy", "one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "bomb", "flag"]
-    colors = ["blue", "red"]
-    starting_quantities = {"bomb"  : 6,
-                           "one"   : 1,
-                           "two"   : 1,
-                           "three" : 2,
-                           "four"  : 3,
-                           "five"  : 4,
-                           "six"   : 4,
-                           "seven" : 4,
-                           "eight" : 5,
-                           "nine"  : 8,
-                           "spy"   : 1,
-                           "flag"  : 1}
-
-    board_rows = 10
-    board_columns = 10
-    board = []
-    row = []
-    for color in colors:
-        n = 0
-        pieces_used = defaultdict(lambda: 0)
-        while n < 40:
-            piece = random.choice(names_of_pieces)
-            if pieces_used[piece] < starting_quantities[piece]:
-                row.append(f"{color}_{piece}")
-                pieces_used[piece] += 1
-                n += 1
-                if len(row) == board_columns:
-                    board.append(row)
-                    row = []
-
-        if color == "blue":
-            board.append([None for _ in range(board_columns)])
-            board.append([None for _ in range(board_columns)])
-
-    b = Board()
-    b.board = board
-    return b
+    """Returns a board with a random starting setup for both sides"""
+    return Board.from_cells(setup_generator.random_boards(1, random.getrandbits(64))[0])
+
+def create_new_board(library=None, blue_index=None, red_index=None):
+    """Returns a board with a starting setup for both sides.
+
+    Setups are taken from the setup library (see setup_library.py), by default the one at
+    setup_library.DEFAULT_PATH. blue_index / red_index pick a setup by its index in the
+    library for reproducible games, otherwise they are sampled at random. If there is no
+    library a genetic algorithm is evolved for this game instead, which is slow."""
+    if library is None and os.path.exists(setup_library.DEFAULT_PATH):
+        library = setup_library.load()
+    elif isinstance(library, str):
+        library = setup_library.load(library)
+
+    if library is not None:
+        if blue_index is None:
+            blue_index = random.randrange(len(library))
+        if red_index is None:
+            red_index = random.randrange(len(library))
+        blue_board = library.layout(blue_index)
+        red_board = library.layout(red_index)
+    else:
+        ga = genetic_algoritgm(100, 10000,  0.4, 0.6)
+        ga.execute()
+        i = random.sample(range(10), 2)
+
+        blue_board = ga.population[i[0]]
+        red_board = ga.population[i[1]]
 
-def create_new_board():
     b = Board()
-    b.initialize()
-    ga = genetic_algoritgm(100, 10000,  0.4, 0.6)
-    ga.execute()
-    i = random.sample(range(10), 2)
-
-    blue_board = ga.population[i[0]]
-    red_board = ga.population[i[1]]
-
-    
     for i in range(4):
         for j in range(10):
             x = blue_board[i][j]
-            b.board[i][j] = f"blue_{x}"
+            b.set_at(f"blue_{x}", i, j)
     
     for i in reversed(range(6,10)):
         for j in reversed(range(10)):
             x = red_board[9-i][9 -j]
-            b.board[i][j] = f"red_{x}"
+            b.set_at(f"red_{x}", i, j)
         
     return b
 
 
 
+def main():
+    game = Game()
+    game.board = create_new_board()
+    game.display_board()
+    # game.start()
 
-board = create_new_board()
-
-game = Game()
-game.board = board
-game.display_board()
-
-heuristic = Heuristic(game.board)
-print(heuristic.evaluate())
 
-# game.start()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
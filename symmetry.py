@@ -0,0 +1,31 @@
+"""Left-right mirror symmetry of setups and positions.
+
+The lakes are symmetric under mirroring the columns (column c <-> 9 - c), so a setup or a
+position and its mirror image are strategically the same. Each pair is mapped to a canonical
+representative, the lexicographically smaller of the two, so caches can treat them as one.
+Note that evaluate.defense_around_flag is not mirror symmetric (it centres the flag on column
+5), so its scores must not be shared between mirror images.
+"""
+
+
+def mirror_layout(layout):
+    """Returns the mirror image of a layout given as rows"""
+    return [list(row[::-1]) for row in layout]
+
+
+def canonical_layout_key(layout):
+    """Hashable key shared by a layout and its mirror image"""
+    flat = tuple(piece for row in layout for piece in row)
+    mirrored = tuple(piece for row in layout for piece in reversed(row))
+    return min(flat, mirrored)
+
+
+def canonical_layout_bytes(layout):
+    """Same as canonical_layout_key for a (4, 10) array of piece types"""
+    return min(layout.tobytes(), layout[:, ::-1].tobytes())
+
+
+def mirror_cells(cells, size=10):
+    """Returns the mirror image of a flat size * size board (list, array or numpy row)"""
+    return [cells[r * size + c] for r in range(size) for c in reversed(range(size))]
+
@@ -0,0 +1,33 @@
+import unittest
+import numpy as np
+import pieces
+import setup_generator
+import symmetry
+from GeneticAlgorithm import FitnessCache
+
+
+class TestSymmetry(unittest.TestCase):
+
+    def test_canonical_keys(self):
+        for layout in setup_generator.random_layouts(50, 7):
+            mirrored = layout[:, ::-1]
+            chosen = min(layout.ravel().tolist(), mirrored.ravel().tolist())
+            key = symmetry.canonical_layout_key(layout.tolist())
+            self.assertEqual(key, symmetry.canonical_layout_key(mirrored.tolist()))
+            self.assertEqual(key, tuple(chosen))
+            self.assertEqual(symmetry.canonical_layout_bytes(layout), bytes(chosen))
+            self.assertEqual(symmetry.canonical_layout_bytes(mirrored), bytes(chosen))
+
+    def test_mirror_images_share_an_entry(self):
+        cache = FitnessCache(lambda board: 1, mirror=True)
+        board = setup_generator.random_layout()
+        cache(board)
+        cache(symmetry.mirror_layout(board))
+        array = np.array([[pieces.RANK_OF[name] for name in row] for row in board], dtype=np.int8)
+        cache.score_all([array, array[:, ::-1].copy()])
+        self.assertEqual(2, len(cache))
+        self.assertEqual(2, cache.misses)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+"""Fixed size transposition table for the alpha-beta search (see heuristic.MinMax).
+
+Entries are kept in parallel arrays, so the table takes size_mb megabytes however many
+positions are stored. Positions are keyed by their 64-bit Zobrist hash (Board.hash) and map
+to a bucket of two entries: the first keeps the deepest search of the bucket (depth-preferred)
+and the second takes every other store (always-replace). Entries left over from an earlier
+search never block the first slot, see new_search.
+"""
+from array import array
+
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+# key, depth, bound, age, score, move
+ENTRY_BYTES = 8 + 1 + 1 + 1 + 4 + 2
+SLOTS = 2
+
+
+class TranspositionTable:
+
+    def __init__(self, size_mb=16):
+        """Table of size_mb megabytes"""
+        self.buckets = max(1, int(size_mb * 2 ** 20) // (ENTRY_BYTES * SLOTS))
+        n = self.buckets * SLOTS
+        self.keys = array("Q", bytes(8 * n))
+        self.depths = array("b", bytes(n))
+        self.bounds = array("b", bytes(n))
+        # Search the entry was stored by, 0 marks an empty slot
+        self.ages = array("B", bytes(n))
+        self.scores = array("i", bytes(4 * n))
+        # Best move as source_square * 100 + target_square, -1 if there is none
+        self.moves = array("h", [-1]) * n
+        self.age = 1
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.collisions = 0
+
+    def __len__(self):
+        """Number of entries in use"""
+        return self.buckets * SLOTS - self.ages.count(0)
+
+    def new_search(self):
+        """Mark the entries stored so far as old"""
+        self.age = self.age % 255 + 1
+
+    def probe(self, key):
+        """Returns (depth, bound, score, move) stored for key, or None. A probe that finds the
+        bucket taken by other positions counts as a collision."""
+        i = (key % self.buckets) * SLOTS
+        ages = self.ages
+        keys = self.keys
+        for slot in (i, i + 1):
+            if ages[slot] and keys[slot] == key:
+                self.hits += 1
+                return self.depths[slot], self.bounds[slot], self.scores[slot], self.moves[slot]
+        if ages[i] or ages[i + 1]:
+            self.collisions += 1
+        self.misses += 1
+        return None
+
+    def store(self, key, depth, bound, score, move=-1):
+        """Store the result of a depth ply search of the position with the given key.
+        The depth-preferred slot takes it unless it holds a deeper search from this search."""
+        i = (key % self.buckets) * SLOTS
+        ages = self.ages
+        if ages[i] == self.age and depth < self.depths[i]:
+            i += 1
+        if move < 0 and ages[i] and self.keys[i] == key:
+            move = self.moves[i]
+        self.keys[i] = key
+        self.depths[i] = depth
+        self.bounds[i] = bound
+        self.ages[i] = self.age
+        self.scores[i] = score
+        self.moves[i] = move
+        self.stores += 1
@@ -1,5 +1,14 @@
+import contextlib
+import io
+import os
+import subprocess
+import sys
 import unittest
 import stratego
+import symmetry
+import pieces
+import utils
+import numpy as np
 
 
 class TestBoard(unittest.TestCase):
@@ -32,6 +41,35 @@ class TestBoard(unittest.TestCase):
             self.assertEqual(expected, actual, \
                              f" ({row},{column}) should have been {expected_bounds}.")
 
+    def test_compact_cells(self):
+        board = stratego.Board()
+        board.set_at("red_nine", 2, 3)
+        self.assertEqual(100, len(board.cells), "Board should hold one byte per square")
+        c = board.code_at(2, 3)
+        self.assertEqual(pieces.RED, pieces.color_of(c))
+        self.assertEqual(pieces.SCOUT, pieces.rank_of(c))
+        self.assertEqual("red_nine", board.board[2][3])
+        self.assertIsNone(board.board[0][0])
+        with self.assertRaisesRegex(Exception, "BoardLocationOutOfBounds"):
+            board.code_at(10, 0)
+
+    def test_clone_is_independent(self):
+        board = stratego.Board()
+        board.set_at("blue_flag", 0, 0)
+        clone = board.clone()
+        clone.remove_at(0, 0)
+        clone.set_at("red_spy", 9, 9)
+        self.assertEqual("blue_flag", board.get_from(0, 0))
+        self.assertFalse(board.is_occuppied(9, 9))
+        self.assertFalse(clone.is_occuppied(0, 0))
+
+    def test_board_rows_round_trip(self):
+        board = stratego.random_board()
+        copy = stratego.Board()
+        copy.board = board.board
+        self.assertEqual(board.cells, copy.cells)
+        self.assertEqual(str(board), str(copy))
+
 
 class TestGame(unittest.TestCase):
 
@@ -128,6 +166,135 @@ class TestGame(unittest.TestCase):
         # Flag
         self.assertVictor("red_nine", "blue_flag", "red_nine")
 
+    def test_legal_moves(self):
+        moves = set(self.game.legal_moves("blue"))
+        self.assertIn((1,1,0,1), moves)
+        self.assertIn((4,4,4,5), moves, "Attacking an adjacent enemy is legal.")
+        self.assertIn((9,8,0,8), moves, "Scouts can move many spaces.")
+        self.assertNotIn((4,4,3,4), moves, "Place already occuppied by piece of the same color.")
+        self.assertNotIn((1,1,2,2), moves, "One should not be able to move diagonally.")
+        for row, column, _, _ in moves:
+            self.assertNotIn((row, column), [(0,0), (9,9)], "Bombs and flags cannot move.")
+
+        self.game.set_at("blue_nine", 3,2)
+        moves = set(self.game.legal_moves("blue"))
+        self.assertNotIn((3,2,4,2), moves, "Illegal move into no-man's land.")
+        self.assertNotIn((3,2,6,2), moves, "Nine/Scout should not be able to jump over no-man's land.")
+
+        # A scout may attack the first enemy along its path but not beyond it
+        self.game.set_at("red_two", 5,8)
+        moves = set(self.game.legal_moves("blue"))
+        self.assertIn((9,8,5,8), moves)
+        self.assertNotIn((9,8,4,8), moves)
+
+    def test_legal_moves_match_is_valid_move(self):
+        g = stratego.Game()
+        g.board = stratego.random_board()
+        for row, column in [(3,0), (3,4), (3,9), (2,4), (6,1), (6,5)]:
+            g.remove_at(row, column)
+        for color in ["blue", "red"]:
+            expected = set()
+            for row in range(10):
+                for column in range(10):
+                    p = g.is_occuppied(row, column)
+                    if not p or g.color_of(p) != color:
+                        continue
+                    for target_row in range(10):
+                        for target_column in range(10):
+                            if g.is_occuppied(target_row, target_column):
+                                continue
+                            if g.is_valid_move(row, column, target_row, target_column):
+                                expected.add((row, column, target_row, target_column))
+            actual = set(m for m in g.legal_moves(color) if not g.is_occuppied(m[2], m[3]))
+            self.assertEqual(expected, actual)
+
+    def test_push_and_pop_move(self):
+        g = stratego.Game()
+        g.board = stratego.random_board()
+        g.remove_at(3, 4)
+        g.set_at("red_two", 4, 4)
+        before = g.board.cells[:]
+        for color in ["blue", "red"]:
+            for move in g.legal_moves(color):
+                g.push_move(move)
+                self.assertFalse(g.is_occuppied(move[0], move[1]))
+                g.pop_move()
+                self.assertEqual(before, g.board.cells)
+        self.assertEqual([], g.history)
+
+    def test_incremental_hash(self):
+        g = stratego.Game()
+        g.board = stratego.random_board()
+        g.remove_at(3, 4)
+        start = g.board.hash()
+        self.assertEqual(start, g.board.clone().hash())
+        for _ in range(20):
+            moves = g.legal_moves(pieces.COLORS[g.board.turn])
+            if not moves:
+                break
+            g.push_move(moves[0])
+            key = g.board.hash()
+            g.board.rehash()
+            self.assertEqual(key, g.board.hash())
+        while g.history:
+            g.pop_move()
+        self.assertEqual(start, g.board.hash())
+
+    def test_hash_includes_side_to_move(self):
+        board = stratego.Board()
+        board.set_at("blue_one", 0, 0)
+        key = board.hash()
+        board.pass_turn()
+        self.assertNotEqual(key, board.hash())
+        board.pass_turn()
+        self.assertEqual(key, board.hash())
+        board.remove_at(0, 0)
+        self.assertEqual(stratego.Board().hash(), board.hash())
+
+    def test_canonical_hash_of_mirror_image(self):
+        g = stratego.Game()
+        g.board = stratego.random_board()
+        mirror = stratego.Board.from_cells(symmetry.mirror_cells(g.board.cells))
+        self.assertEqual(g.board.key, mirror.mirror_key)
+        self.assertEqual(g.board.canonical_hash(), mirror.canonical_hash())
+        for _ in range(10):
+            g.push_move(g.legal_moves(pieces.COLORS[g.board.turn])[0])
+        mirror_key = g.board.mirror_key
+        g.board.rehash()
+        self.assertEqual(mirror_key, g.board.mirror_key)
+        self.assertEqual(mirror_key, g.board.clone().mirror_key)
+
+    def test_push_move_records_fight(self):
+        self.game.push_move((4,4,4,5))
+        source, target, attacker, defender, victor = self.game.history[-1]
+        self.assertEqual((44, 45), (source, target))
+        self.assertEqual("blue_five", pieces.decode(attacker))
+        self.assertEqual("red_five", pieces.decode(defender))
+        self.assertEqual("blue_five", self.game.get_from(4,5))
+        self.game.pop_move()
+        self.assertEqual("blue_five", self.game.get_from(4,4))
+        self.assertEqual("red_five", self.game.get_from(4,5))
+        self.assertRaises(Exception, self.game.pop_move)
+
+    def test_battle_matrix(self):
+        bm = utils.get_bm()
+        self.assertEqual((12, 12), bm.shape)
+        attackers = np.array([pieces.SPY, pieces.SPY, pieces.MINER, pieces.SCOUT, pieces.MARSHALL])
+        defenders = np.array([pieces.MARSHALL, pieces.SCOUT + 7, pieces.BOMB, pieces.BOMB, pieces.SPY])
+        expected = [utils.ATTACKER_WINS, utils.DEFENDER_WINS, utils.ATTACKER_WINS,
+                    utils.DEFENDER_WINS, utils.ATTACKER_WINS]
+        self.assertEqual(expected, bm[attackers, defenders].tolist())
+        for attacker in range(10):
+            for defender in range(1, 11):
+                if attacker == pieces.SPY and defender == pieces.MARSHALL:
+                    continue
+                a = pieces.decode(pieces.code(pieces.RED, attacker))
+                d = pieces.decode(pieces.code(pieces.BLUE, defender))
+                expected = utils.ATTACKER_WINS
+                if self.game.piece_value(a) < self.game.piece_value(d):
+                    expected = utils.DEFENDER_WINS
+                self.assertEqual(expected, bm[attacker, defender], f"{a} attacking {d}")
+
     def test_game_over(self):
         g = stratego.Game()
         # Stalemate
@@ -153,6 +320,16 @@ class TestGame(unittest.TestCase):
         g.set_at("red_one", 0, 1)
         self.assertFalse(g.game_over(), "Game should not be over yet.")
 
+    def test_player_without_moves_loses(self):
+        g = stratego.Game()
+        for piece, row, column in [("blue_flag", 0, 0), ("blue_nine", 0, 5), ("blue_bomb", 0, 4),
+                                   ("blue_bomb", 0, 6), ("blue_bomb", 1, 5), ("red_flag", 9, 9),
+                                   ("red_one", 9, 0)]:
+            g.set_at(piece, row, column)
+        self.assertFalse(g.game_over())
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual("red", g.start())
+
 
     def assertVictor(self, attacker, defender, expectedVictor):
         actual = self.game.attack(attacker, defender)
@@ -167,6 +344,20 @@ class TestGame(unittest.TestCase):
         self.assertFalse(actual, "Piece should not be able to move like that. " + message)        
 
 
+
+class TestStartup(unittest.TestCase):
+
+    # Wall-clock budget for "import stratego" in a fresh interpreter
+    IMPORT_BUDGET_SECONDS = 1.0
+
+    def test_import_is_cheap(self):
+        code = "import time; t = time.perf_counter(); import stratego; print(time.perf_counter() - t)"
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+        elapsed = float(result.stdout.split()[-1])
+        self.assertLess(elapsed, self.IMPORT_BUDGET_SECONDS,
+                        f"import stratego took {elapsed:.3f}s, it must not build a game or load heavy dependencies.")
+
         
 if __name__ == '__main__':
     unittest.main()
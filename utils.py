@@ -4,6 +4,8 @@ import numpy as np
 from inspect import signature
 from dataclasses import dataclass
 
+import pieces
+
 
 class Singleton(type):
     _instances = {}
@@ -47,8 +49,51 @@ class RollingMeter(object):
 
     def push(self, val, n=1):
         self.val = val
-        self.avg = self.sum / self.count
+        if self.count == 0:
+            self.max = val
+            self.min = val
         self.sum += val * n
+        self.count += n
+        self.avg = self.sum / self.count
         self.max = max(self.max, val)
         self.min = min(self.min, val)
-        self.count += n
\ No newline at end of file
+
+ATTACKER_WINS = 1
+BOTH_DIE = 0
+DEFENDER_WINS = -1
+
+
+def _build_battle_matrix():
+    values = [0, 0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 100]
+    bm = np.empty((pieces.NUM_TYPES, pieces.NUM_TYPES), dtype=np.int8)
+    for attacker in range(pieces.NUM_TYPES):
+        for defender in range(pieces.NUM_TYPES):
+            if attacker == pieces.BOMB:
+                outcome = ATTACKER_WINS
+            elif defender == pieces.BOMB:
+                outcome = ATTACKER_WINS if attacker == pieces.MINER else DEFENDER_WINS
+            elif attacker == pieces.SPY and defender == pieces.MARSHALL:
+                outcome = ATTACKER_WINS
+            elif values[attacker] >= values[defender]:
+                # Tie goes to the attacker
+                outcome = ATTACKER_WINS
+            else:
+                outcome = DEFENDER_WINS
+            bm[attacker, defender] = outcome
+    bm.flags.writeable = False
+    return bm
+
+
+_battle_matrix = None
+
+
+def get_bm():
+    """
+    Returns the read-only 12x12 battle matrix indexed by [attacker type, defender type]
+    (piece types from pieces.py) holding ATTACKER_WINS, DEFENDER_WINS or BOTH_DIE.
+    Index it with numpy arrays of types to resolve many fights at once.
+    """
+    global _battle_matrix
+    if _battle_matrix is None:
+        _battle_matrix = _build_battle_matrix()
+    return _battle_matrix